@@ -38,6 +38,7 @@ TAXONOMIC_ASSIGNMENTS="${OUTPUT_REPRESENTATIVES%.*}.results"
 UCHIME_RESULTS="${OUTPUT_REPRESENTATIVES%.*}.uchime"
 UCHIME_LOG="${OUTPUT_REPRESENTATIVES%.*}.log"
 OTU_TABLE="${FINAL_FASTA%.*}.OTU.filtered.cleaved.table"
+OTU_METADATA="${OTU_TABLE%.*}.metadata"  # OTU_TABLE without sample columns
 OUTPUT_TABLE="${OTU_TABLE%.*}.nosubstringOTUs.table"
 
 ## ------------------------------------------------------------------- functions
@@ -119,7 +120,8 @@ cleaving() {
         --per_sample_stats "${POTENTIAL_SUB_SEEDS}" \
         --struct "${OUTPUT_STRUCT}" \
         --swarms "${OUTPUT_SWARMS}" \
-        --fasta "${FINAL_FASTA}"
+        --fasta "${FINAL_FASTA}" \
+        --threads "${THREADS}"
 }
 
 fake_taxonomic_assignment2() {
@@ -158,18 +160,20 @@ chimera_detection2() {
 build_occurrence_table() {
     python3 \
         "${SRC}/${OTU_TABLE_BUILDER}" \
-        --representatives <(cat "${OUTPUT_REPRESENTATIVES}"{,2}) \
-        --stats <(cat "${OUTPUT_STATS}"{,2}) \
-        --swarms <(cat "${OUTPUT_SWARMS}"{,2}) \
-        --chimera <(cat "${UCHIME_RESULTS}"{,2}) \
+        --representatives "${OUTPUT_REPRESENTATIVES}"{,2} \
+        --stats "${OUTPUT_STATS}"{,2} \
+        --swarms "${OUTPUT_SWARMS}"{,2} \
+        --chimera "${UCHIME_RESULTS}"{,2} \
         --quality "${QUALITY_FILE}" \
-        --assignments <(cat "${TAXONOMIC_ASSIGNMENTS}"{2,}) \
-        --distribution "${DISTRIBUTION_FILE}" > "${OTU_TABLE}"
+        --assignments "${TAXONOMIC_ASSIGNMENTS}"{2,} \
+        --distribution "${DISTRIBUTION_FILE}" \
+        --metadata "${OTU_METADATA}" \
+        --threads "${THREADS}" > "${OTU_TABLE}"
 }
 
 extract_fasta_and_search_for_identical_sequences() {
     # excluding terminal gaps
-    awk 'NR > 1 {printf ">"$1"\n"$10"\n"}' "${OTU_TABLE}" | \
+    awk 'NR > 1 {printf ">"$1"\n"$10"\n"}' "${OTU_METADATA}" | \
         "${VSEARCH}" \
             --threads "${THREADS}" \
             --cluster_smallmem - \
@@ -192,7 +196,7 @@ merge_superstrings() {
 }
 
 check_that_number_of_reads_did_not_change() {
-    local -ri BEFORE=$(awk 'NR > 1 {total += $2} END {print total}' "${OTU_TABLE}")
+    local -ri BEFORE=$(awk 'NR > 1 {total += $2} END {print total}' "${OTU_METADATA}")
     local -ri AFTER=$(awk 'NR > 1 {total += $2} END {print total}' "${OUTPUT_TABLE}")
     if (( ${BEFORE} != ${AFTER} )) ; then
         echo "sub/superstring mergig went wrong" 1>&2
@@ -9,11 +9,126 @@ __date__ = "2021/03/19"
 __version__ = "$Revision: 1.2"
 
 import os
-import re
 import sys
-import copy
 import argparse
 import operator
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from amplicon_registry import AmpliconRegistry
+from cluster_index import SWARM_TOKEN, cluster_index_load
+from compressed_io import open_input, open_output, uncompressed_name
+from fasta_index import fasta_index_load
+
+# read-only data shared with worker processes (inherited when forking)
+SHARED = dict()
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+
+class SubClusters:
+    """
+    Sub-clusters of a cluster, indexed by amplicon.
+
+    Sub-clusters are sets of amplicon ids, keyed by their seed, in
+    order of creation. Each amplicon points to the sub-clusters it
+    belongs to (usually only one), so that the first sub-cluster
+    containing an amplicon is found without scanning all of them.
+    """
+
+    def __init__(self):
+        self.members = dict()
+        self.owners = dict()
+        self.ranks = dict()
+
+    def new(self, seed):
+        """
+        Start a sub-cluster (replaces a previous one with the same seed).
+        """
+        if seed in self.members:
+            for amplicon in self.members[seed]:
+                self.owners[amplicon].remove(seed)
+        else:
+            self.ranks[seed] = len(self.ranks)
+        self.members[seed] = set()
+        self.add(seed, seed)
+
+    def add(self, seed, amplicon):
+        """
+        Add an amplicon to a sub-cluster.
+        """
+        if amplicon in self.members[seed]:
+            return
+        self.members[seed].add(amplicon)
+        owners = self.owners.setdefault(amplicon, list())
+        owners.append(seed)
+        if len(owners) > 1:  # keep sub-clusters in order of creation
+            owners.sort(key=self.ranks.get)
+
+    def link(self, father, son):
+        """
+        Add a son to the sub-clusters of its father.
+        """
+        # assuming a father-son link
+        d = self.first_owner(father)
+        if d is not None:
+            self.add(d, son)
+        else:
+            # father is not in the sub-clusters (i.e. an "orphan"
+            # created by the grafting process)
+            for d in self.all_owners(son):
+                self.add(d, father)
+
+    def first_owner(self, amplicon):
+        """
+        Return the seed of the first sub-cluster containing an amplicon.
+        """
+        owners = self.owners.get(amplicon)
+        return owners[0] if owners else None
+
+    def all_owners(self, amplicon):
+        """
+        Return the seeds of all sub-clusters containing an amplicon.
+        """
+        return list(self.owners.get(amplicon, ()))
+
+
+class CleavedClusters:
+    """
+    Cleaved clusters stored in flat arrays.
+
+    The amplicon ids and abundances of the k-th cluster are stored
+    between offsets[k] and offsets[k + 1], by decreasing abundance
+    (the seed comes first).
+    """
+
+    def __init__(self):
+        self.amplicons = array("I")
+        self.abundances = array("Q")
+        self.offsets = array("Q", [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, amplicons, abundances):
+        """
+        Store a cluster (amplicon ids and abundances, seed first).
+        """
+        self.amplicons.extend(amplicons)
+        self.abundances.extend(abundances)
+        self.offsets.append(len(self.amplicons))
+
+    def cluster(self, k):
+        """
+        Return amplicon ids and abundances of the k-th cluster.
+        """
+        start, end = self.offsets[k], self.offsets[k + 1]
+        return self.amplicons[start:end], self.abundances[start:end]
 
 
 # *************************************************************************** #
@@ -54,41 +169,53 @@ if __name__ == '__main__':
                         required=True,
                         help="list of amplicons per cluster")
 
+    parser.add_argument("--compress",
+                        dest="compress",
+                        action="store_true",
+                        default=False,
+                        help="block-compress output files (.gz)")
+
+    parser.add_argument("-t", "--threads",
+                        dest="threads",
+                        type=int,
+                        default=1,
+                        help="number of threads (compression, and cleaving"
+                        " if the swarms file is indexed)")
+
     ARGS = parser.parse_args()
 
 
-def per_sample_stats_parse(per_sample_stats_file, percentage):
+def per_sample_stats_parse(registry, per_sample_stats_file, percentage):
     """
     Map samples, OTU seeds and stats.
     """
     separator = "\t"
-    per_sample_stats = [dict() for i in range(0, 256)]
+    per_sample_stats = dict()
     number_of_samples = 0
     previous_sample = None
 
-    with open(per_sample_stats_file, "r") as stats_file:
+    with open_input(per_sample_stats_file) as stats_file:
         print("PROGRESS: parsing per-sample stats", file=sys.stderr)
         for line in stats_file:
             line = line.strip().split(separator)
             sample, cloud, mass, seed, seed_abundance = line[0:5]
-            index = int(seed[0:2], 16)
-            if seed in per_sample_stats[index]:
-                per_sample_stats[index][seed] += 1
+            seed_id = registry.add(seed)
+            if seed_id in per_sample_stats:
+                per_sample_stats[seed_id] += 1
             else:
-                per_sample_stats[index][seed] = 1
+                per_sample_stats[seed_id] = 1
             if sample != previous_sample:
                 previous_sample = sample
                 number_of_samples += 1
 
     # keep only local seeds present in at least "percentage" of samples
     threshold = percentage * number_of_samples
-    seeds = [{k: v for k, v in per_sample_stats[i].items() if v >= threshold}
-             for i in range(0, 256)]
+    seeds = {k: v for k, v in per_sample_stats.items() if v >= threshold}
 
     return threshold, seeds
 
 
-def stats_parse(global_stats_file, threshold, seeds):
+def stats_parse(registry, global_stats_file, threshold, seeds):
     """
     Find and eliminate global seeds.
     """
@@ -101,7 +228,7 @@ def stats_parse(global_stats_file, threshold, seeds):
     # less than 1 read per sample which is not possible.
     # 3 - consequently, a global seed cannot have an abundance smaller
     # than the threshold value.
-    with open(global_stats_file, "r") as stats_file:
+    with open_input(global_stats_file) as stats_file:
         print("PROGRESS: parsing stats", file=sys.stderr)
         for line in stats_file:
             line = line.strip().split(separator)
@@ -115,15 +242,24 @@ def stats_parse(global_stats_file, threshold, seeds):
             # and with enough reads to be hosting a secondary seed
             # that passes our threshold
             if int(cloud) > 1 and int(mass) >= 2 * threshold + int(singletons):
-                index = int(seed[0:2], 16)
+                seed_id = registry.get(seed)
                 # eliminate global seeds from the list of seeds
-                if seed in seeds[index]:
-                    del seeds[index][seed]
+                if seed_id in seeds:
+                    del seeds[seed_id]
 
     return None
 
 
-def swarms_parse(swarms_file, seeds):
+def indexed_lines(input_file, ranges):
+    """
+    Yield the lines found in byte ranges of a file (binary mode).
+    """
+    for start, end in ranges:
+        input_file.seek(start)
+        yield from input_file.read(end - start).splitlines(keepends=True)
+
+
+def swarms_parse(registry, swarms_file, seeds, index=None):
     """
     Map amplicons and abundance values. Only keep clusters with local seeds.
     """
@@ -133,62 +269,96 @@ def swarms_parse(swarms_file, seeds):
     # with a lower total abundance. Hence, I can only rely on a search
     # through the "swarms" file to get a full list of clusters that
     # can be cleaved.
-    separator = "_|;size=|;? "  # parsing of abundance annotations
-    swarms = [dict() for i in range(0, 256)]
-    global_seeds = [dict() for i in range(0, 256)]
-    seeds_set = {k for d in seeds for k in d.keys()}
-    number_of_seeds = len(seeds_set)
-
-    with open(swarms_file, "r") as swarms_file:
-        print("PROGRESS: parsing swarms", file=sys.stderr)
-        for line in swarms_file:
-            line = line.strip()
-            amplicons = re.split(separator, line)[0::2]
-            abundances = re.split(separator, line)[1::2]
-            seed = amplicons[0]
-            common = seeds_set & set(amplicons)
-            if common:
-                number_of_seeds -= len(common)
-                for amplicon, abundance in zip(amplicons, abundances):
-                    index = int(amplicon[0:2], 16)
-                    swarms[index][amplicon] = int(abundance)
-                for amplicon in common:
-                    index = int(amplicon[0:2], 16)
-                    global_seeds[index][amplicon] = seed
-            if number_of_seeds == 0:
+    swarms = dict()
+    global_seeds = dict()
+    # seeds are compared by name while tokenizing (SHA1 in lowercase)
+    seed_names = {registry.name(seed_id).encode("ascii") for seed_id in seeds}
+    number_of_seeds = len(seed_names)
+
+    with open_input(swarms_file, "rb") as swarms_file:
+        lines = swarms_file
+        if index is not None:
+            print("PROGRESS: reading indexed swarms", file=sys.stderr)
+            # only read the clusters of local seeds (in file order)
+            clusters = {index.line_of(registry.digest(seed_id))
+                        for seed_id in seeds}
+            clusters.discard(None)
+            lines = indexed_lines(swarms_file, [index.line_range(line)
+                                                for line in sorted(clusters)])
+        else:
+            print("PROGRESS: parsing swarms", file=sys.stderr)
+        for line in lines:
+            if number_of_seeds == 0:  # all local seeds were found
                 break
+            # search for a first local seed (nothing is stored)
+            tokens = SWARM_TOKEN.finditer(line)
+            for match in tokens:
+                if match.group(1) in seed_names:
+                    break
+            else:
+                continue  # no local seed in that cluster
+            # amplicons before the first local seed are matched again
+            # (seed lines only), the others come from the same pass
+            amplicons = SWARM_TOKEN.findall(line, 0, match.start())
+            amplicons.append(match.groups())
+            amplicons.extend(match.groups() for match in tokens)
+            common = {registry[amplicon] for amplicon, abundance
+                      in amplicons if amplicon in seed_names}
+            number_of_seeds -= len(common)
+            for amplicon, abundance in amplicons:
+                swarms[registry.add(amplicon)] = int(abundance)
+            seed_id = registry.get(amplicons[0][0])
+            for amplicon_id in common:
+                global_seeds[amplicon_id] = seed_id
 
     return swarms, global_seeds
 
 
-def struct_parse(struct_file, seeds, global_seeds):
+def struct_parse(registry, struct_file, seeds, global_seeds, index=None):
     """
     carve out sub-clusters.
     """
     separator = "\t"
-    global_seeds_set = {v for d in global_seeds for v in d.values()}
-    number_of_seeds = sum([len(d) for d in seeds])
+    global_seeds_set = set(global_seeds.values())
+    number_of_seeds = len(seeds)
     previous_cluster_id = 0
-    clusters = dict()
+    clusters = SubClusters()
     new_clusters = list()
-
-    with open(struct_file, "r") as struct_file:
+    followed = False
+
+    if index is not None:
+        # only read the clusters of global seeds (in file order)
+        targets = {index.struct_cluster_of(registry.digest(seed_id))
+                   for seed_id in global_seeds_set}
+        targets.discard(None)
+        ranges = [index.struct_range(k) for k in sorted(targets)]
+        # is the last cluster read followed by other clusters?
+        followed = bool(ranges) and ranges[-1][1] < index.struct_size
+        struct_file = open(struct_file, "rb")
+        lines = (line.decode("ascii")
+                 for line in indexed_lines(struct_file, ranges))
+        print("PROGRESS: reading indexed struct", file=sys.stderr)
+    else:
+        struct_file = open_input(struct_file)
+        lines = struct_file
         print("PROGRESS: parsing struct", file=sys.stderr)
-        for line in struct_file:
+
+    with struct_file:
+        for line in lines:
             line = line.strip()
             father, son, diffs, cluster_id, steps = line.split(separator)
 
             # initialize per-cluster parameters
             if int(cluster_id) != previous_cluster_id:
-                if clusters:  # save previous results, if any
-                    new_clusters.append(clusters)
+                if clusters.members:  # save previous results, if any
+                    new_clusters.append(clusters.members)
                 previous_cluster_id = int(cluster_id)
-                global_seed = father
+                global_seed = registry.get(father)
                 has_a_local_seed = (True if global_seed in global_seeds_set
                                     else False)
-                clusters = dict()
+                clusters = SubClusters()
                 if has_a_local_seed:
-                    clusters[global_seed] = set([global_seed])
+                    clusters.new(global_seed)
 
             # stop parsing the file as soon as possible
             if number_of_seeds == 0:
@@ -198,149 +368,275 @@ def struct_parse(struct_file, seeds, global_seeds):
             if has_a_local_seed is False:
                 continue
 
+            # amplicons of clusters with local seeds are all registered
+            father = registry[father]
+            son = registry[son]
+
             # detect local seeds
-            index = int(son[0:2], 16)
-            if son in seeds[index]:
+            if son in seeds:
                 number_of_seeds -= 1
-                clusters[son] = set([son])
+                clusters.new(son)
                 continue
 
-            # populate cluster (assuming a father-son link)
-            for d in clusters:
-                if father in clusters[d]:
-                    clusters[d].add(son)
-                    break
-            else:
-                # father is not in the sub-clusters (i.e. an "orphan"
-                # created by the grafting process)
-                for d in clusters:
-                    if son in clusters[d]:
-                        clusters[d].add(father)
+            # populate cluster
+            clusters.link(father, son)
+        else:
+            # a full parse saves the last cluster on the next cluster change
+            if followed and clusters.members:
+                new_clusters.append(clusters.members)
 
     return new_clusters
 
 
-def add_abundance_values(swarms_file, new_clusters, swarms):
+def add_abundance_values(registry, swarms_file, new_clusters, swarms):
     """
     Add abundance values and sort (deal with a rare case).
     """
     print("PROGRESS: sorting each cluster", file=sys.stderr)
-    new_clusters_with_abundance = copy.deepcopy(new_clusters)  # suboptimal
+    new_clusters_with_abundance = CleavedClusters()
     for i, super_cluster in enumerate(new_clusters):
-        for cluster in super_cluster:
-            swarm = list()
-            for amplicon in super_cluster[cluster]:
-                index = int(amplicon[0:2], 16)
-                abundance = swarms[index][amplicon]
-                swarm.append((amplicon, abundance))
-            # sort amplicons by decreasing abundance value and by
-            # name (fix a rare bug: a tie leading to wrong seed
-            # selection)
-            swarm.sort(key = lambda x: (-x[1], x[0]))
-
-            # check if the seed changed after sorting (rare case)
-            seed = swarm[0][0]
-            if seed != cluster:
-                del new_clusters_with_abundance[i][cluster]
-                cluster = seed
-            new_clusters_with_abundance[i][cluster] = swarm
+        for swarm in sub_clusters_sort(registry, super_cluster, swarms):
+            new_clusters_with_abundance.append(
+                swarm, [swarms[amplicon] for amplicon in swarm])
+        new_clusters[i] = None  # release sets as soon as possible
 
     return new_clusters_with_abundance
 
 
-def per_cluster_stats(global_stats_file, new_clusters_with_abundance):
+def sub_clusters_sort(registry, super_cluster, swarms):
+    """
+    Sort the amplicons of each sub-cluster.
+    """
+    # sub-clusters keep their order, unless their seed changes
+    sorted_clusters = dict.fromkeys(super_cluster)
+    for cluster in super_cluster:
+        # sort amplicons by decreasing abundance value and by
+        # name (fix a rare bug: a tie leading to wrong seed
+        # selection; digests sort like names)
+        swarm = sorted(super_cluster[cluster],
+                       key=lambda x: (-swarms[x], registry.digest(x)))
+
+        # check if the seed changed after sorting (rare case)
+        seed = swarm[0]
+        if seed != cluster:
+            del sorted_clusters[cluster]
+            cluster = seed
+        sorted_clusters[cluster] = swarm
+
+    return list(sorted_clusters.values())
+
+
+def share_with_workers(shared):
+    """
+    Initialize a worker process with read-only data.
+    """
+    SHARED.update(shared)
+
+
+def cluster_cleave(registry, lines, seeds):
+    """
+    Carve out the sub-clusters of a struct cluster.
+    """
+    clusters = SubClusters()
+    detections = list()  # positions of local seeds (see parallel_cleave)
+    for position, line in enumerate(lines):
+        father, son, diffs, cluster_id, steps = line.strip().split("\t")
+        father = registry[father]
+        son = registry[son]
+        if position == 0:
+            clusters.new(father)  # global seed
+        if son in seeds:
+            detections.append(position)
+            clusters.new(son)
+            continue
+        clusters.link(father, son)
+
+    return clusters.members, detections, len(lines)
+
+
+def cluster_cleave_worker(struct_file, ranges):
+    """
+    Cleave and sort struct clusters in a worker process.
+    """
+    registry = SHARED["registry"]
+    results = list()
+    with open(struct_file, "rb") as input_file:
+        for start, end in ranges:
+            input_file.seek(start)
+            lines = input_file.read(end - start).decode("ascii").splitlines()
+            members, detections, length = cluster_cleave(
+                registry, lines, SHARED["seeds"])
+            results.append((sub_clusters_sort(registry, members,
+                                              SHARED["swarms"]),
+                            detections, length))
+
+    return results
+
+
+def parallel_cleave(registry, struct_file, seeds, global_seeds, swarms,
+                    index, threads):
+    """
+    Cleave and sort clusters in worker processes (see struct_parse).
+    """
+    print("PROGRESS: cleaving clusters", file=sys.stderr)
+    targets = {index.struct_cluster_of(registry.digest(seed_id))
+               for seed_id in set(global_seeds.values())}
+    targets.discard(None)
+    ranges = [index.struct_range(k) for k in sorted(targets)]
+
+    # map: cleave batches of clusters of similar sizes (in bytes)
+    batch_size = sum([end - start for start, end in ranges]) // (4 * threads)
+    batches = [list()]
+    size = 0
+    for start, end in ranges:
+        if size > batch_size:
+            batches.append(list())
+            size = 0
+        batches[-1].append((start, end))
+        size += end - start
+    with ProcessPoolExecutor(max_workers=threads,
+                             mp_context=get_context("fork"),
+                             initializer=share_with_workers,
+                             initargs=({"registry": registry,
+                                        "seeds": seeds,
+                                        "swarms": swarms},)
+                             ) as executor:
+        jobs = [executor.submit(cluster_cleave_worker, struct_file, batch)
+                for batch in batches if batch]
+        results = [result for job in jobs for result in job.result()]
+
+    # reduce: replay the early stop of a sequential parse. Parsing
+    # stops at the first line read after the last local seed: the
+    # cluster is lost, unless that seed is on its last line and other
+    # clusters follow (the last cluster of the file is never saved)
+    new_clusters_with_abundance = CleavedClusters()
+    number_of_seeds = len(seeds)
+    for (start, end), (sorted_clusters, detections, length) in zip(ranges,
+                                                                   results):
+        if number_of_seeds == 0:
+            break
+        saved = end < index.struct_size
+        if number_of_seeds <= len(detections):
+            saved = saved and detections[number_of_seeds - 1] == length - 1
+            number_of_seeds = 0
+        else:
+            number_of_seeds -= len(detections)
+        if saved:
+            for swarm in sorted_clusters:
+                new_clusters_with_abundance.append(
+                    swarm, [swarms[amplicon] for amplicon in swarm])
+
+    return new_clusters_with_abundance
+
+
+def per_cluster_stats(registry, global_stats_file,
+                      new_clusters_with_abundance, compress, threads):
     """
     Compute per-cluster stats.
     """
     print("PROGRESS: computing per-cluster stats", file=sys.stderr)
     new_stats = list()
-    for super_cluster in new_clusters_with_abundance:
-        for cluster in super_cluster:
-            total_abundance = 0
-            singletons = 0
-            seed_abundance = super_cluster[cluster][0][1]
-            for amplicon, abundance in super_cluster[cluster]:
-                total_abundance += abundance
-                if abundance == 1:
-                    singletons += 1
-            # number_of_uniques = 1  # 1. number of unique amplicons
-            # total_abundance = 0    # 2. total abundance of amplicons
-            # seed_label = 0         # 3. label of the initial seed
-            # seed_abundance = 0     # 4. initial seed abundance
-            # singletons = 0         # 5. number of amps with an abundance of 1
-            # number_of_steps = 0    # 6. number of steps in the cluster
-            # number of layers       # 7. columns 6 and 7 are not updated
-            new_stats.append((len(super_cluster[cluster]),
-                              total_abundance,
-                              cluster,
-                              seed_abundance,
-                              singletons,
-                              "0",
-                              "0"))
+    for k in range(len(new_clusters_with_abundance)):
+        amplicons, abundances = new_clusters_with_abundance.cluster(k)
+        # number_of_uniques = 1  # 1. number of unique amplicons
+        # total_abundance = 0    # 2. total abundance of amplicons
+        # seed_label = 0         # 3. label of the initial seed
+        # seed_abundance = 0     # 4. initial seed abundance
+        # singletons = 0         # 5. number of amps with an abundance of 1
+        # number_of_steps = 0    # 6. number of steps in the cluster
+        # number of layers       # 7. columns 6 and 7 are not updated
+        new_stats.append((len(amplicons),
+                          sum(abundances),
+                          registry.name(amplicons[0]),
+                          abundances[0],
+                          abundances.count(1),
+                          "0",
+                          "0"))
     # sort clusters by increasing number of reads first, then in a
     # second step sort by decreasing number of unique amplicons, and
     # amplicon name (sort by amplicon name first, stable sorting will
     # preserve the order for ties)
     new_stats.sort(key=operator.itemgetter(2))
     new_stats.sort(key=operator.itemgetter(1, 0), reverse=True)
-    with open(global_stats_file + "2", "w") as new_stats_file:
+    new_stats_file = uncompressed_name(global_stats_file) + "2"
+    if compress:
+        new_stats_file += ".gz"
+    with open_output(new_stats_file, threads) as new_stats_file:
         for t in new_stats:
             print(*t, sep="\t", file=new_stats_file)
 
     return new_stats
 
 
-def per_cluster_swarms(swarms_file, new_clusters_with_abundance):
+def per_cluster_swarms(registry, swarms_file, new_clusters_with_abundance,
+                       compress, threads):
     """
     Compute per-cluster swarms.
     """
     print("PROGRESS: computing per-cluster swarms", file=sys.stderr)
-    with open(swarms_file + "2", "w") as new_swarms_file:
-        for super_cluster in new_clusters_with_abundance:
-            for cluster in super_cluster:
-                print(*[t[0] + ";size=" + str(t[1]) for t in super_cluster[cluster]],
-                      sep=" ", file=new_swarms_file)
+    new_swarms_file = uncompressed_name(swarms_file) + "2"
+    if compress:
+        new_swarms_file += ".gz"
+    with open_output(new_swarms_file, threads) as new_swarms_file:
+        for k in range(len(new_clusters_with_abundance)):
+            amplicons, abundances = new_clusters_with_abundance.cluster(k)
+            print(*[registry.name(amplicon) + ";size=" + str(abundance)
+                    for amplicon, abundance in zip(amplicons, abundances)],
+                  sep=" ", file=new_swarms_file)
 
     return None
 
 
-def fasta_parse(fasta_file, new_stats, swarm_parameters):
+def fasta_parse(registry, fasta_file, new_stats, swarm_parameters,
+                compress, threads):
     """
     Get seed sequences, update abundances.
     """
-    new_representatives_file = (os.path.splitext(fasta_file)[0]
+    new_representatives_file = (os.path.splitext(
+        uncompressed_name(fasta_file))[0]
                                 + "_"
                                 + swarm_parameters
                                 + "_representatives.fas2")
+    if compress:
+        new_representatives_file += ".gz"
     # create a dict of target amplicons and abundances
-    fasta = [dict() for i in range(0, 256)]
+    fasta = dict()
     for t in new_stats:
-        index = int(t[2][0:2], 16)
-        fasta[index][t[2]] = [t[1]]
+        fasta[registry[t[2]]] = [t[1]]
     min_abundance = min([t[3] for t in new_stats])
-    # filter the fasta file
-    index = None
+    amplicon_id = None
     separator = ";size="
-    with open(fasta_file, "r") as fasta_file:
-        print("PROGRESS: parsing fasta file", file=sys.stderr)
-        for line in fasta_file:
-            if line.startswith(">"):
-                amplicon, abundance = line.strip(">;\n").split(separator)
-                index = int(amplicon[0:2], 16)
-                if int(abundance) < min_abundance:
-                    break  # no need to read more lines
-            else:
-                if amplicon in fasta[index]:
-                    fasta[index][amplicon].append(line.strip())
-
-    with open(new_representatives_file, "w") as new_representatives_file:
+    index = fasta_index_load(fasta_file)
+    if index is not None:
+        # fetch target sequences only
+        print("PROGRESS: reading indexed fasta file", file=sys.stderr)
+        for amplicon_id in fasta:
+            sequence = index.get(registry.digest(amplicon_id))
+            if sequence is not None:
+                fasta[amplicon_id].append(sequence)
+    else:
+        # filter the fasta file
+        with open_input(fasta_file) as fasta_file:
+            print("PROGRESS: parsing fasta file", file=sys.stderr)
+            for line in fasta_file:
+                if line.startswith(">"):
+                    amplicon, abundance = line.strip(">;\n").split(separator)
+                    amplicon_id = registry.get(amplicon)
+                    if int(abundance) < min_abundance:
+                        break  # no need to read more lines
+                else:
+                    if amplicon_id in fasta:
+                        fasta[amplicon_id].append(line.strip())
+
+    with open_output(new_representatives_file,
+                     threads) as new_representatives_file:
         for t in new_stats:
             amplicon = t[2]
-            index = int(amplicon[0:2], 16)
+            amplicon_id = registry[amplicon]
             try:
-                abundance, sequence = fasta[index][amplicon]
+                abundance, sequence = fasta[amplicon_id]
             except ValueError:
-                print(amplicon, fasta[index][amplicon], min_abundance)
+                print(amplicon, fasta[amplicon_id], min_abundance)
                 sys.exit(-1)
             print(">" + amplicon + separator + str(abundance)
                   + "\n" + sequence, sep="", file=new_representatives_file)
@@ -358,6 +654,8 @@ def main():
     struct_file = ARGS.struct_file
     swarms_file = ARGS.swarms_file
     fasta_file = ARGS.fasta_file
+    compress = ARGS.compress
+    threads = ARGS.threads
 
     # fastidious or not?
     if "_1f." in swarms_file and "_1f." in struct_file:
@@ -368,23 +666,44 @@ def main():
     # cleaving threshold (keystone parameter)
     PERCENTAGE = 0.05
 
+    # amplicon names are resolved once into integer ids
+    registry = AmpliconRegistry()
+
     # Parse input files
-    threshold, seeds = per_sample_stats_parse(per_sample_stats_file,
+    threshold, seeds = per_sample_stats_parse(registry,
+                                              per_sample_stats_file,
                                               PERCENTAGE)
-    stats_parse(global_stats_file, threshold, seeds)
-    swarms, global_seeds = swarms_parse(swarms_file, seeds)
-    new_clusters = struct_parse(struct_file, seeds, global_seeds)
-
-    # Add abundance values
-    new_clusters_with_abundance = add_abundance_values(swarms_file,
-                                                       new_clusters,
-                                                       swarms)
+    stats_parse(registry, global_stats_file, threshold, seeds)
+    # prebuilt cluster index, if any (see cluster_index.py)
+    index = cluster_index_load(swarms_file, struct_file)
+    swarms, global_seeds = swarms_parse(registry, swarms_file, seeds, index)
+    if index is not None and threads > 1:
+        # clusters are cleaved independently, in worker processes
+        # (batches are cut in the struct file with the index)
+        new_clusters_with_abundance = parallel_cleave(registry, struct_file,
+                                                      seeds, global_seeds,
+                                                      swarms, index, threads)
+    else:
+        if threads > 1 and index is None:
+            print("PROGRESS: no cluster index, cleaving in one process",
+                  file=sys.stderr)
+        new_clusters = struct_parse(registry, struct_file, seeds,
+                                    global_seeds, index)
+
+        # Add abundance values
+        new_clusters_with_abundance = add_abundance_values(registry,
+                                                           swarms_file,
+                                                           new_clusters,
+                                                           swarms)
 
     # Create output files (stats2, swarms2, fas2)
-    new_stats = per_cluster_stats(global_stats_file,
-                                  new_clusters_with_abundance)
-    per_cluster_swarms(swarms_file, new_clusters_with_abundance)
-    fasta_parse(fasta_file, new_stats, swarm_parameters)
+    new_stats = per_cluster_stats(registry, global_stats_file,
+                                  new_clusters_with_abundance,
+                                  compress, threads)
+    per_cluster_swarms(registry, swarms_file, new_clusters_with_abundance,
+                       compress, threads)
+    fasta_parse(registry, fasta_file, new_stats, swarm_parameters,
+                compress, threads)
 
     return
 
@@ -8,10 +8,522 @@ __author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
 __date__ = "2023/04/15"
 __version__ = "$Revision: 4.3"
 
+import os
 import re
 import sys
 from argparse import ArgumentParser
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import itertools
 import operator
+import json
+import sqlite3
+import datetime
+
+from amplicon_registry import AmpliconRegistry
+from columnar_table import (COLUMNS, TYPECODES, ColumnarTableWriter,
+                            sparse_transpose)
+from compressed_io import is_compressed, open_input, open_output
+from distribution_index import distribution_index_load
+from fasta_index import LazySequences, fasta_index_load
+from snapshot_cache import (cache_key, cache_load, cache_store,
+                            digests_fingerprint, file_fingerprint)
+
+try:
+    import h5py  # optional, BIOM HDF5 output
+except ImportError:
+    h5py = None
+
+# read-only data shared with worker processes (inherited when forking)
+SHARED = dict()
+
+# output formats and file extensions (sweep mode)
+TABLE_EXTENSIONS = {"tsv": ".table",
+                    "biom": ".biom",
+                    "hdf5": ".biom",
+                    "columnar": ".columnar",
+                    "sqlite": ".sqlite",
+                    "long": ".long.table"}
+
+# output formats that cannot be written to stdout
+FILE_FORMATS = ("hdf5", "columnar", "sqlite")
+
+# column types in SQLite exports (OTU is the primary key)
+SQL_TYPES = {column: "INTEGER" for column in TYPECODES}
+SQL_TYPES.update({"OTU": "INTEGER PRIMARY KEY", "quality": "REAL"})
+for column in COLUMNS:
+    SQL_TYPES.setdefault(column, "TEXT")
+
+# version of cached parser results (increment when a parser changes)
+SNAPSHOT_VERSION = 1
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+class SeedSampleMatrix:
+    """
+    Sparse seed-by-sample count matrix.
+
+    Seeds and samples are dense integer ids. Counts are first stored
+    per sample (a column is a pair of flat arrays: seed ids and
+    counts), then transposed in bulk into compressed sparse rows
+    (indptr, indices, data) once all samples are known.
+    """
+
+    def __init__(self, number_of_seeds):
+        self.number_of_seeds = number_of_seeds
+        self.number_of_samples = 0
+        self.indptr = array("Q", [0]) * (number_of_seeds + 1)
+        self.indices = array("I")
+        self.data = array("Q")
+        self.columns = dict()
+
+    def add_column(self, sample_id, seed_ids, counts):
+        """
+        Store seed ids and counts observed in a sample.
+        """
+        if sample_id in self.columns:
+            # deal with duplicated samples (sum with previous occurrences)
+            column = dict(zip(*self.columns[sample_id]))
+            for seed_id, count in zip(seed_ids, counts):
+                column[seed_id] = column.get(seed_id, 0) + count
+            seed_ids = array("I", column.keys())
+            counts = array("Q", column.values())
+        self.columns[sample_id] = (seed_ids, counts)
+
+    def compress(self, sample_order):
+        """
+        Transpose columns into sparse rows (columns in sample_order).
+        """
+        row_lengths = Counter()
+        for seed_ids, counts in self.columns.values():
+            row_lengths.update(seed_ids)
+        total = 0
+        for seed_id in range(self.number_of_seeds):
+            total += row_lengths[seed_id]
+            self.indptr[seed_id + 1] = total
+        self.indices = array("I", [0]) * total
+        self.data = array("Q", [0]) * total
+        next_position = self.indptr[:-1]
+        for new_id, sample_id in enumerate(sample_order):
+            if sample_id not in self.columns:
+                continue
+            seed_ids, counts = self.columns.pop(sample_id)
+            for seed_id, count in zip(seed_ids, counts):
+                position = next_position[seed_id]
+                self.indices[position] = new_id
+                self.data[position] = count
+                next_position[seed_id] = position + 1
+        self.number_of_samples = len(sample_order)
+
+    def fill_rows(self, rows, number_of_samples):
+        """
+        Store sparse rows (dicts of sample ids and counts) in seed order.
+        """
+        for seed_id, row in enumerate(rows):
+            for sample_id in sorted(row):
+                self.indices.append(sample_id)
+                self.data.append(row[sample_id])
+            self.indptr[seed_id + 1] = len(self.indices)
+        self.number_of_samples = number_of_samples
+
+    def row(self, seed_id):
+        """
+        Return sample ids and counts of a seed.
+        """
+        start, end = self.indptr[seed_id], self.indptr[seed_id + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def row_spreads(self):
+        """
+        Return the number of samples with a non-zero count, per seed.
+        """
+        # zero counts are never stored
+        return array("Q", map(operator.sub, self.indptr[1:], self.indptr[:-1]))
+
+    def row_totals(self):
+        """
+        Return the sum of counts, per seed.
+        """
+        return array("Q", [sum(self.data[start:end]) for start, end
+                           in zip(self.indptr[:-1], self.indptr[1:])])
+
+
+class TableWriter:
+    """
+    Buffered writer of occurrence table lines.
+
+    Sample cells start as a copy of a row of "0" strings, and only
+    non-zero counts are converted. Lines are joined and written in
+    large blocks.
+    """
+
+    def __init__(self, output, samples, columns=COLUMNS,
+                 buffer_size=1 << 22):
+        self.output = output
+        self.zeros = ["0"] * len(samples)
+        self.buffer_size = buffer_size
+        self.lines = list()
+        self.size = 0
+        self.write(columns, samples)
+
+    def write(self, fields, cells):
+        """
+        Buffer a line made of metadata fields and sample cells.
+        """
+        line = "\t".join(map(str, fields)) + "\t" + "\t".join(cells)
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_row(self, fields, sample_ids, counts):
+        """
+        Buffer a line made of metadata fields and sparse sample counts.
+        """
+        cells = self.zeros[:]
+        for sample_id, count in zip(sample_ids, map(str, counts)):
+            cells[sample_id] = count
+        self.write(fields, cells)
+
+    def flush(self):
+        """
+        Write buffered lines.
+        """
+        if self.lines:
+            self.lines.append("")  # final newline
+            self.output.write("\n".join(self.lines))
+            self.lines = list()
+            self.size = 0
+
+    def close(self):
+        """
+        Write buffered lines and close the output (except stdout).
+        """
+        self.flush()
+        if self.output is not sys.stdout:
+            self.output.close()
+
+
+class LongTableWriter:
+    """
+    Buffered writer of long-format tables.
+
+    Only non-zero cells are written, one per line (OTU, amplicon,
+    sample, count). OTU metadata are written to a separate file (see
+    SplitTableWriter).
+    """
+
+    def __init__(self, output, samples, buffer_size=1 << 22):
+        self.output = output
+        self.samples = samples
+        self.buffer_size = buffer_size
+        self.lines = ["OTU\tamplicon\tsample\tcount"]
+        self.size = 0
+
+    def write_row(self, fields, sample_ids, counts):
+        """
+        Buffer the non-zero cells of an OTU.
+        """
+        prefix = str(fields[0]) + "\t" + fields[3] + "\t"
+        for sample_id, count in zip(sample_ids, map(str, counts)):
+            line = prefix + self.samples[sample_id] + "\t" + count
+            self.lines.append(line)
+            self.size += len(line)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered lines.
+        """
+        if self.lines:
+            self.lines.append("")  # final newline
+            self.output.write("\n".join(self.lines))
+            self.lines = list()
+            self.size = 0
+
+    def close(self):
+        """
+        Write buffered lines and close the output (except stdout).
+        """
+        self.flush()
+        if self.output is not sys.stdout:
+            self.output.close()
+
+
+class SplitTableWriter:
+    """
+    Write metadata and count-matrix tables next to a main table.
+
+    All tables are written in the same pass, with the same OTU
+    order. The metadata table holds the 13 metadata columns, the
+    count matrix holds the amplicon name followed by sample counts.
+    """
+
+    def __init__(self, table, samples, metadata=None, counts=None):
+        self.table = table
+        self.metadata = metadata
+        self.counts = None
+        if self.metadata is not None:
+            print(*COLUMNS, sep="\t", file=self.metadata)
+        if counts is not None:
+            self.counts = TableWriter(counts, samples, columns=("amplicon",))
+
+    def write_row(self, fields, sample_ids, counts):
+        """
+        Write an OTU to all tables.
+        """
+        self.table.write_row(fields, sample_ids, counts)
+        if self.metadata is not None:
+            print(*fields, sep="\t", file=self.metadata)
+        if self.counts is not None:
+            self.counts.write_row((fields[3],), sample_ids, counts)
+
+    def close(self):
+        """
+        Close all tables.
+        """
+        self.table.close()
+        if self.metadata is not None:
+            self.metadata.close()
+        if self.counts is not None:
+            self.counts.close()
+
+
+class BiomWriter:
+    """
+    Writer of sparse BIOM tables (JSON format).
+
+    OTU metadata are written as soon as a row is received, while
+    non-zero counts are kept as (row, column, count) triplets in flat
+    arrays, and written at the end. No dense matrix is built.
+    """
+
+    def __init__(self, output, samples):
+        self.output = output
+        self.number_of_samples = len(samples)
+        self.number_of_rows = 0
+        self.rows = array("I")
+        self.columns = array("I")
+        self.counts = array("Q")
+        header = {"id": None,
+                  "format": "Biological Observation Matrix 1.0.0",
+                  "format_url": "http://biom-format.org",
+                  "type": "OTU table",
+                  "generated_by": "OTU_contingency_table_filtered.py "
+                  + __version__.strip("$"),
+                  "date": datetime.datetime.now().isoformat(),
+                  "matrix_type": "sparse",
+                  "matrix_element_type": "int",
+                  "columns": [{"id": sample, "metadata": None}
+                              for sample in samples]}
+        # open the list of rows (other keys are written at the end)
+        self.output.write(json.dumps(header)[:-1] + ", \"rows\": [")
+
+    def write_row(self, fields, sample_ids, counts):
+        """
+        Write the metadata of an OTU, and buffer its non-zero counts.
+        """
+        metadata = dict(zip(COLUMNS, fields))
+        # biom reads taxonomies as lists of ranks (stampa's separator)
+        metadata["taxonomy"] = str(metadata["taxonomy"]).split("|")
+        row = {"id": metadata.pop("amplicon"), "metadata": metadata}
+        if self.number_of_rows:
+            self.output.write(",")
+        self.output.write("\n" + json.dumps(row))
+        self.rows.extend(itertools.repeat(self.number_of_rows,
+                                          len(sample_ids)))
+        self.columns.extend(sample_ids)
+        self.counts.extend(counts)
+        self.number_of_rows += 1
+
+    def close(self):
+        """
+        Write counts and table shape, and close the output.
+        """
+        self.output.write("],\n\"data\": [")
+        triplets = zip(self.rows, self.columns, self.counts)
+        separator = ""
+        while True:
+            block = ["[%d,%d,%d]" % triplet
+                     for triplet in itertools.islice(triplets, 1 << 16)]
+            if not block:
+                break
+            self.output.write(separator + ",\n".join(block))
+            separator = ",\n"
+        self.output.write("],\n\"shape\": ["
+                          + str(self.number_of_rows) + ", "
+                          + str(self.number_of_samples) + "]}\n")
+        if self.output is not sys.stdout:
+            self.output.close()
+
+
+class BiomHDF5Writer:
+    """
+    Writer of sparse BIOM 2.1 tables (HDF5 format, requires h5py).
+
+    Counts are stored as compressed sparse rows (observation matrix)
+    and columns (sample matrix), OTU metadata as one dataset per
+    column.
+    """
+
+    def __init__(self, output, samples):
+        self.output = output
+        self.samples = samples
+        self.ids = list()
+        self.metadata = {column: list() for column in COLUMNS
+                         if column != "amplicon"}
+        self.indptr = array("Q", [0])
+        self.indices = array("I")
+        self.data = array("Q")
+
+    def write_row(self, fields, sample_ids, counts):
+        """
+        Buffer the metadata and the non-zero counts of an OTU.
+        """
+        for column, field in zip(COLUMNS, fields):
+            if column == "amplicon":
+                self.ids.append(field)
+            else:
+                self.metadata[column].append(field)
+        self.indices.extend(sample_ids)
+        self.data.extend(counts)
+        self.indptr.append(len(self.indices))
+
+    def close(self):
+        """
+        Write the HDF5 file.
+        """
+        column_indptr, column_indices, column_data = sparse_transpose(
+            self.indptr, self.indices, self.data, len(self.samples))
+
+        strings = h5py.string_dtype()
+        with h5py.File(self.output, "w") as biom_file:
+            biom_file.attrs["id"] = "No Table ID"
+            biom_file.attrs["type"] = "OTU table"
+            biom_file.attrs["format-url"] = "http://biom-format.org"
+            biom_file.attrs["format-version"] = (2, 1)
+            biom_file.attrs["generated-by"] = (
+                "OTU_contingency_table_filtered.py " + __version__.strip("$"))
+            biom_file.attrs["creation-date"] = (
+                datetime.datetime.now().isoformat())
+            biom_file.attrs["shape"] = (len(self.ids), len(self.samples))
+            biom_file.attrs["nnz"] = len(self.data)
+            for axis, ids, indptr, indices, data in (
+                    ("observation", self.ids,
+                     self.indptr, self.indices, self.data),
+                    ("sample", self.samples,
+                     column_indptr, column_indices, column_data)):
+                biom_file.create_dataset(axis + "/ids", data=list(ids),
+                                         dtype=strings)
+                biom_file.create_dataset(axis + "/matrix/data",
+                                         data=list(data), dtype="float64")
+                biom_file.create_dataset(axis + "/matrix/indices",
+                                         data=list(indices), dtype="int32")
+                biom_file.create_dataset(axis + "/matrix/indptr",
+                                         data=list(indptr), dtype="int32")
+                biom_file.create_group(axis + "/metadata")
+                biom_file.create_group(axis + "/group-metadata")
+            for column, values in self.metadata.items():
+                if column == "taxonomy":
+                    # biom reads taxonomies as lists of ranks: split
+                    # stampa's ranks and pad rows with empty strings
+                    ranks = [str(value).split("|") for value in values]
+                    width = max([len(row) for row in ranks], default=1)
+                    biom_file.create_dataset(
+                        "observation/metadata/" + column,
+                        shape=(len(ranks), width), dtype=strings,
+                        data=[row + [""] * (width - len(row))
+                              for row in ranks] if ranks else None)
+                # "NA" quality values make a column of strings
+                elif any(isinstance(value, str) for value in values):
+                    values = list(map(str, values))
+                    biom_file.create_dataset("observation/metadata/" + column,
+                                             data=values, dtype=strings)
+                else:
+                    biom_file.create_dataset("observation/metadata/" + column,
+                                             data=values)
+
+
+class SQLiteWriter:
+    """
+    Writer of occurrence tables as SQLite databases.
+
+    OTU metadata go to an otus table, sample names to a samples table,
+    and non-zero counts to a long-format occurrences table. Rows are
+    inserted in bulk, in batched transactions, and indexes are created
+    once all rows are loaded.
+    """
+
+    def __init__(self, output, samples, batch_size=1 << 16):
+        if os.path.exists(output):
+            os.remove(output)
+        self.connection = sqlite3.connect(output)
+        self.batch_size = batch_size
+        self.otus = list()
+        self.occurrences = list()
+        # the database is rebuilt from scratch if the run fails
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        columns = ", ".join(['"' + column + '" ' + SQL_TYPES[column]
+                             for column in COLUMNS])
+        with self.connection:
+            self.connection.execute("CREATE TABLE otus (" + columns + ")")
+            self.connection.execute("CREATE TABLE samples "
+                                    "(sample_id INTEGER PRIMARY KEY, "
+                                    "name TEXT)")
+            self.connection.execute("CREATE TABLE occurrences "
+                                    "(otu_id INTEGER, sample_id INTEGER, "
+                                    "count INTEGER)")
+            self.connection.executemany("INSERT INTO samples VALUES (?, ?)",
+                                        enumerate(samples))
+
+    def write_row(self, fields, sample_ids, counts):
+        """
+        Buffer the metadata and the non-zero counts of an OTU.
+        """
+        fields = [None if field == "NA" and column == "quality" else field
+                  for column, field in zip(COLUMNS, fields)]
+        otu_id = fields[0]
+        self.otus.append(fields)
+        self.occurrences.extend(zip(itertools.repeat(otu_id), sample_ids,
+                                    counts))
+        if len(self.occurrences) + len(self.otus) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Insert buffered rows (one transaction).
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO otus VALUES ("
+                + ", ".join(["?"] * len(COLUMNS)) + ")", self.otus)
+            self.connection.executemany(
+                "INSERT INTO occurrences VALUES (?, ?, ?)", self.occurrences)
+        self.otus = list()
+        self.occurrences = list()
+
+    def close(self):
+        """
+        Insert remaining rows, index tables and close the database.
+        """
+        self.flush()
+        with self.connection:
+            for table, column in (("otus", "amplicon"),
+                                  ("otus", "taxonomy"),
+                                  ("occurrences", "otu_id"),
+                                  ("occurrences", "sample_id")):
+                self.connection.execute(
+                    "CREATE INDEX " + table + "_" + column + " ON "
+                    + table + " (" + column + ")")
+        self.connection.close()
 
 
 # *************************************************************************** #
@@ -29,22 +541,34 @@ def arg_parse():
     parser.add_argument("-r", "--representatives",
                         action="store",
                         dest="representatives",
-                        required=True)
+                        nargs="+",
+                        required=True,
+                        help="one or several files (later files supersede "
+                        "earlier ones)")
 
     parser.add_argument("-s", "--stats",
                         action="store",
                         dest="stats",
-                        required=True)
+                        nargs="+",
+                        required=True,
+                        help="one or several files (later files supersede "
+                        "earlier ones)")
 
     parser.add_argument("-sw", "--swarms",
                         action="store",
                         dest="swarms",
-                        required=True)
+                        nargs="+",
+                        required=True,
+                        help="one or several files (later files supersede "
+                        "earlier ones)")
 
     parser.add_argument("-c", "--chimera",
                         action="store",
                         dest="chimera",
-                        required=True)
+                        nargs="+",
+                        required=True,
+                        help="one or several files (later files supersede "
+                        "earlier ones)")
 
     parser.add_argument("-q", "--quality",
                         action="store",
@@ -54,7 +578,10 @@ def arg_parse():
     parser.add_argument("-a", "--assignments",
                         action="store",
                         dest="assignments",
-                        required=True)
+                        nargs="+",
+                        required=True,
+                        help="one or several files (later files supersede "
+                        "earlier ones)")
 
     parser.add_argument("-d", "--distribution",
                         action="store",
@@ -65,40 +592,214 @@ def arg_parse():
                         action="store",
                         dest="EE_threshold",
                         type=float,
-                        default=0.0002,
+                        nargs="+",
+                        default=[0.0002],
+                        required=False)
+
+    parser.add_argument("--min_abundance",
+                        action="store",
+                        dest="min_abundance",
+                        type=int,
+                        nargs="+",
+                        default=[3],
+                        required=False)
+
+    parser.add_argument("--min_spread",
+                        action="store",
+                        dest="min_spread",
+                        type=int,
+                        nargs="+",
+                        default=[2],
+                        required=False)
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        dest="output",
+                        default=None,
+                        required=False,
+                        help="output file (default: standard output), "
+                        "block-compressed if its name ends with .gz")
+
+    parser.add_argument("-m", "--metadata",
+                        action="store",
+                        dest="metadata",
+                        default=None,
+                        required=False,
+                        help="also write OTU metadata to this file "
+                        "(required by the long format, default: output "
+                        "file + '.metadata'; sweep mode: table file + "
+                        "'.metadata')")
+
+    parser.add_argument("--counts",
+                        action="store",
+                        dest="counts",
+                        default=None,
+                        required=False,
+                        help="also write the count matrix (amplicon and "
+                        "sample columns) to this file (sweep mode: table "
+                        "file + '.counts')")
+
+    parser.add_argument("-f", "--format",
+                        action="store",
+                        dest="table_format",
+                        choices=sorted(TABLE_EXTENSIONS),
+                        default="tsv",
+                        required=False,
+                        help="tsv (default), biom (sparse JSON), hdf5 "
+                        "(BIOM 2.1, requires h5py), columnar (binary, "
+                        "see columnar_table.py), sqlite or long (non-zero "
+                        "cells only, metadata in a separate file)")
+
+    parser.add_argument("--sweep_prefix",
+                        action="store",
+                        dest="sweep_prefix",
+                        default=None,
+                        required=False,
+                        help="write one table per combination of filter "
+                        "values, and a summary")
+
+    parser.add_argument("--cache_dir",
+                        action="store",
+                        dest="cache_dir",
+                        default=None,
+                        required=False,
+                        help="keep parsed inputs in this folder")
+
+    parser.add_argument("--cache_size",
+                        action="store",
+                        dest="cache_size",
+                        type=float,
+                        default=20.0,
+                        required=False,
+                        help="maximal size of the cache folder (in GB)")
+
+    parser.add_argument("-t", "--threads",
+                        action="store",
+                        dest="threads",
+                        type=int,
+                        default=1,
                         required=False)
 
     args = parser.parse_args()
 
+    if args.sweep_prefix is None and (len(args.EE_threshold) > 1
+                                      or len(args.min_abundance) > 1
+                                      or len(args.min_spread) > 1):
+        parser.error("several filter values require --sweep_prefix")
+
+    if args.table_format == "hdf5" and h5py is None:
+        parser.error("hdf5 format requires the h5py module")
+    if (args.table_format in FILE_FORMATS and args.output is None
+            and args.sweep_prefix is None):
+        parser.error(args.table_format + " format requires --output")
+    if args.table_format == "long" and args.output is None:
+        if args.metadata is None and args.sweep_prefix is None:
+            parser.error("long format requires --output or --metadata")
+
     return args.representatives, args.stats, args.swarms, \
         args.chimera, args.quality, args.assignments, \
-        args.distribution, args.EE_threshold
+        args.distribution, args.EE_threshold, args.min_abundance, \
+        args.min_spread, args.output, args.metadata, args.counts, \
+        args.table_format, \
+        args.sweep_prefix, args.cache_dir, int(args.cache_size * 1e9), \
+        args.threads
 
 
-def representatives_parse(stampa, repre):
-    # "${REPRESENTATIVES}" \
+def supersede(results):
+    """
+    Merge mappings parsed from several files (later files win).
+    """
+    merged = dict()
+    for result in results:
+        merged.update(result)
+
+    return merged
+
+
+def representatives_parse(registry, stampa, repre):
+    # "${REPRESENTATIVES}" "${REPRESENTATIVES}2" \
     """
     Get seed sequences.
     """
     separator = ";size="
-    representatives_file = repre
-    representatives = [dict() for i in range(0, 256)]
-    with open(representatives_file, "r") as representatives_file:
-        print("PROGRESS: parsing fasta representatives", file=sys.stderr)
-        for line in representatives_file:
-            if line.startswith(">"):
-                amplicon = line.strip(">;\n").split(separator)[0]
-                index = int(amplicon[0:2], 16)
-            else:
-                # discard small OTUs not needed in the final table
-                if amplicon in stampa[index]:
-                    representatives[index][amplicon] = line.strip()
+    representatives = dict()
+    for representatives_file in repre:
+        with open_input(representatives_file) as representatives_file:
+            print("PROGRESS: parsing fasta representatives", file=sys.stderr)
+            for line in representatives_file:
+                if line.startswith(">"):
+                    amplicon = line.strip(">;\n").split(separator)[0]
+                    amplicon_id = registry.get(amplicon)
+                else:
+                    # discard small OTUs not needed in the final table
+                    if amplicon_id in stampa:
+                        representatives[amplicon_id] = line.strip()
+
+    return representatives
+
+
+def representatives_index(registry, stampa, repre):
+    """
+    Locate seed sequences in indexed fasta files (read lazily).
+    """
+    indexes = [fasta_index_load(representatives_file)
+               for representatives_file in repre]
+    if None in indexes:  # files without a valid index are parsed
+        return None
+    print("PROGRESS: locating fasta representatives", file=sys.stderr)
+    representatives = LazySequences()
+    for index in indexes:
+        for k in range(len(index)):
+            amplicon_id = registry.get_digest(index.digest(k))
+            # discard small OTUs not needed in the final table
+            if amplicon_id in stampa:
+                representatives.locate(amplicon_id, index, k)
+
+    return representatives
+
+
+def representatives_cached_parse(registry, stampa, repre,
+                                 cache_dir, cache_size):
+    """
+    Get seed sequences (from a fasta index or the cache, if possible).
+    """
+    representatives = representatives_index(registry, stampa, repre)
+    if representatives is not None:
+        return representatives
+    if cache_dir is None:
+        return representatives_parse(registry, stampa, repre)
+    key = cache_key("representatives", SNAPSHOT_VERSION,
+                    *map(file_fingerprint, repre),
+                    digests_fingerprint(map(registry.digest, stampa)))
+    snapshot = cache_load(cache_dir, key)
+    if snapshot is not None:
+        print("PROGRESS: loading cached fasta representatives",
+              file=sys.stderr)
+        seeds, offsets = snapshot["seeds"], snapshot["offsets"]
+        sequences = snapshot["sequences"]
+        representatives = dict()
+        for i in range(0, len(offsets) - 1):
+            seed_id = registry.get_digest(seeds[20 * i:20 * i + 20].tobytes())
+            representatives[seed_id] = (
+                sequences[offsets[i]:offsets[i + 1]].tobytes().decode())
+        return representatives
+
+    representatives = representatives_parse(registry, stampa, repre)
+    sequences = [sequence.encode() for sequence in representatives.values()]
+    offsets = array("Q", [0])
+    for sequence in sequences:
+        offsets.append(offsets[-1] + len(sequence))
+    cache_store(cache_dir, key,
+                {"seeds": b"".join(map(registry.digest, representatives)),
+                 "offsets": offsets,
+                 "sequences": b"".join(sequences)},
+                cache_size)
 
     return representatives
 
 
-def stats_parse(representatives, stat):
-    # "${STATS}" \
+def stats_parse(registry, representatives, stat):
+    # "${STATS}" (one file) \
     """
     Map OTU seeds and stats.
     """
@@ -106,174 +807,509 @@ def stats_parse(representatives, stat):
     stats_file = stat
     stats = dict()
     seeds = dict()
-    with open(stats_file, "r") as stats_file:
+    with open_input(stats_file) as stats_file:
         print("PROGRESS: parsing stats", file=sys.stderr)
         for line in stats_file:
             line = line.strip().split(separator)
             cloud, mass, seed, seed_abundance = line[0:4]
-            index = int(seed[0:2], 16)
-            if seed in representatives[index]:
-                stats[seed] = int(mass)
-                seeds[seed] = (int(seed_abundance), int(cloud))
-    # Sort OTUs by decreasing mass
+            seed_id = registry.get(seed)
+            if seed_id in representatives:
+                stats[seed_id] = int(mass)
+                seeds[seed_id] = (int(seed_abundance), int(cloud))
+
+    return stats, seeds
+
+
+def stats_sort(registry, stats):
+    """
+    Sort OTUs by decreasing mass (and name, digests sort like names).
+    """
     sorted_stats = sorted(iter(stats.items()),
-                          key=operator.itemgetter(1, 0))
+                          key=lambda t: (t[1], registry.digest(t[0])))
     sorted_stats.reverse()
 
-    return stats, sorted_stats, seeds
+    return sorted_stats
 
 
-def swarms_parse(representatives, swarm):
-    # "${SWARMS}" \
+def swarms_parse(registry, representatives, swarm):
+    # "${SWARMS}" "${SWARMS}2" \
     """
     Map OTUs.
     """
     separator = "_[0-9]+|;size=[0-9]+;?| "  # parsing of abundance annotations
-    swarms_file = swarm
-    swarms = [dict() for i in range(0, 256)]
-    valid_OTUs = [dict() for i in range(0, 256)]
-    with open(swarms_file, "r") as swarms_file:
-        print("PROGRESS: parsing swarms", file=sys.stderr)
-        for line in swarms_file:
-            line = line.strip()
-            amplicons = re.split(separator, line)[0::2]
-            seed = amplicons[0]
-            index = int(seed[0:2], 16)
-            if seed in representatives[index]:
-                swarms[index][seed] = [amplicons]
-                for amplicon in amplicons:
-                    index = int(amplicon[0:2], 16)
-                    valid_OTUs[index][amplicon] = seed
+    swarms = dict()
+    valid_OTUs = dict()
+    # distribution loaded from the cache: OTU members are not needed
+    if swarm is None:
+        return swarms, valid_OTUs
+    # amplicons of a cleaved OTU point to their new seed
+    for swarms_file in swarm:
+        with open_input(swarms_file) as swarms_file:
+            print("PROGRESS: parsing swarms", file=sys.stderr)
+            for line in swarms_file:
+                line = line.strip()
+                amplicons = re.split(separator, line)[0::2]
+                seed_id = registry.get(amplicons[0])
+                if seed_id in representatives:
+                    amplicon_ids = [registry.add(amplicon)
+                                    for amplicon in amplicons]
+                    swarms[seed_id] = [amplicon_ids]
+                    for amplicon_id in amplicon_ids:
+                        valid_OTUs[amplicon_id] = seed_id
 
     return swarms, valid_OTUs
 
 
-def uchime_parse(representatives, chime):
-    # "${UCHIME}" \
+def uchime_parse(registry, representatives, chime):
+    # "${UCHIME}" (one file) \
     """
     Map OTU's chimera status.
     """
     separator = "\t"
     uchime_file = chime
-    uchime = dict()  # refactor: create a copy of representatives[index] keys, set status to NA by default
-    with open(uchime_file, "r") as uchime_file:
+    uchime = dict()  # refactor: create a copy of representatives keys, set status to NA by default
+    with open_input(uchime_file) as uchime_file:
         print("PROGRESS: parsing uchime", file=sys.stderr)
         for line in uchime_file:
             OTU = line.strip().split(separator)
             try:
-                seed = OTU[1].split(";")[0]
-                index = int(seed[0:2], 16)
+                seed_id = registry.get(OTU[1].split(";")[0])
             except IndexError:  # deal with partial line (missing seed)
                 continue
             try:
                 status = OTU[17]
             except IndexError:  # deal with unfinished chimera detection runs
                 status = "NA"
-            if seed in representatives[index]:
-                uchime[seed] = status
+            if seed_id in representatives:
+                uchime[seed_id] = status
 
     return uchime
 
 
-def quality_parse(representatives, qual):
+def quality_parse(registry, representatives, qual):
     # "${QUALITY}" \
     """
     List good amplicons.
     """
     quality_file = qual
     quality = dict()
-    with open(quality_file, "r") as quality_file:
+    with open_input(quality_file) as quality_file:
         print("PROGRESS: parsing amplicon quality (EE)", file=sys.stderr)
         for line in quality_file:
             sha1, qual, length = line.strip().split()
-            index = int(sha1[0:2], 16)
-            if sha1 in representatives[index]:
-                quality[sha1] = float(qual) / int(length)
+            amplicon_id = registry.get(sha1)
+            if amplicon_id in representatives:
+                quality[amplicon_id] = float(qual) / int(length)
 
     return quality
 
 
-def stampa_parse(assign):
-    # "${ASSIGNMENTS}" \
+def stampa_parse(registry, assign):
+    # "${ASSIGNMENTS}2" "${ASSIGNMENTS}" \
     """
     Map amplicon ids and taxonomic assignments.
     """
     separator = "\t"
-    stampa_file = assign
-    stampa = [dict() for i in range(0, 256)]
+    stampa = dict()
 
-    with open(stampa_file, "r") as stampa_file:
-        print("PROGRESS: parsing taxonomic assignments", file=sys.stderr)
-        for line in stampa_file:
-            line = line.strip().split(separator)
-            amplicon, abundance, identity, taxonomy, references = line
-            # remove rare but annoying character
-            taxonomy = taxonomy.replace("#", "")
-            index = int(amplicon[0:2], 16)
-            stampa[index][amplicon] = (identity, taxonomy, references)
+    for stampa_file in assign:
+        with open_input(stampa_file) as stampa_file:
+            print("PROGRESS: parsing taxonomic assignments", file=sys.stderr)
+            for line in stampa_file:
+                line = line.strip().split(separator)
+                amplicon, abundance, identity, taxonomy, references = line
+                # remove rare but annoying character
+                taxonomy = taxonomy.replace("#", "")
+                stampa[registry.add(amplicon)] = (identity, taxonomy,
+                                                  references)
 
     return stampa
 
 
-def distribution_parse(valid_OTUs, distr):
+def share_with_workers(shared):
+    """
+    Initialize a worker process with read-only data.
+    """
+    SHARED.update(shared)
+
+
+def seed_parse_worker(parser, filename):
+    """
+    Run a seed-dependent parser in a worker process.
+    """
+    return parser(SHARED["registry"], SHARED["representatives"], filename)
+
+
+def seeds_parse(registry, representatives, stat, swarm, chime, qual,
+                threads):
+    """
+    Parse files that only depend on OTU representatives (concurrently).
+    """
+    parsers = ((stats_parse, stat), (uchime_parse, chime),
+               (quality_parse, [qual]))
+    if threads < 2:
+        swarms = swarms_parse(registry, representatives, swarm)
+        results = [[parser(registry, representatives, filename)
+                    for filename in filenames]
+                   for parser, filenames in parsers]
+    else:
+        # stats, uchime and quality parsers only read the registry:
+        # run them in forked processes, one job per file (registry and
+        # representatives are inherited, not copied), while the swarms
+        # parser, which registers new amplicons, runs in the main
+        # process. Results are collected in file order.
+        number_of_jobs = sum([len(filenames) for parser, filenames in parsers])
+        with ProcessPoolExecutor(max_workers=min(threads - 1, number_of_jobs),
+                                 mp_context=get_context("fork"),
+                                 initializer=share_with_workers,
+                                 initargs=({"registry": registry,
+                                            "representatives":
+                                            representatives},)
+                                 ) as executor:
+            jobs = [[executor.submit(seed_parse_worker, parser, filename)
+                     for filename in filenames]
+                    for parser, filenames in parsers]
+            swarms = swarms_parse(registry, representatives, swarm)
+            results = [[job.result() for job in parser_jobs]
+                       for parser_jobs in jobs]
+
+    # entries of later files (cleaved OTUs) supersede earlier ones
+    stats_results, uchime_results, quality_results = results
+    stats = supersede([stats for stats, seeds in stats_results])
+    seeds = supersede([seeds for stats, seeds in stats_results])
+
+    return ((stats, stats_sort(registry, stats), seeds), swarms,
+            supersede(uchime_results), supersede(quality_results))
+
+
+def plan_filters(valid_OTUs, uchime, quality, EE_threshold):
+    """
+    Keep only amplicons of OTUs that can pass the table filters.
+    """
+    # chimera and quality filters only depend on the OTU seed: apply
+    # them before parsing the (very large) distribution file. Seeds
+    # without a quality value are kept and left to print_table.
+    print("PROGRESS: pruning chimeras and low quality OTUs", file=sys.stderr)
+    eligible_seeds = {seed_id for seed_id, status in uchime.items()
+                      if status == "N"
+                      and quality.get(seed_id, 0.0) <= EE_threshold}
+    valid_OTUs = {amplicon_id: seed_id
+                  for amplicon_id, seed_id in valid_OTUs.items()
+                  if seed_id in eligible_seeds}
+
+    return valid_OTUs
+
+
+def samples_manifest_parse(distr):
+    # "${DISTRIBUTION}.samples"
+    """
+    Map sample names to integer ids (manifest of a distribution file).
+    """
+    manifest_file = distr + ".samples"
+    samples = dict()
+    try:
+        # a manifest older than its distribution file is obsolete
+        if os.path.getmtime(manifest_file) < os.path.getmtime(distr):
+            return samples
+        with open(manifest_file, "r") as manifest_file:
+            print("PROGRESS: parsing sample manifest", file=sys.stderr)
+            for line in manifest_file:
+                samples[line.rstrip("\n")] = len(samples)
+    except OSError:  # no manifest yet
+        pass
+
+    return samples
+
+
+def samples_manifest_write(distr, samples):
+    """
+    Write sorted sample names next to the distribution file.
+
+    Sample ids read from the manifest are then column ids, and the
+    next runs skip the sorting and remapping of samples.
+    """
+    # skip pipes and process substitutions
+    if not os.path.isfile(distr):
+        return None
+    manifest_file = distr + ".samples"
+    try:
+        with open(manifest_file, "w") as manifest_file:
+            for sample in samples:
+                print(sample, file=manifest_file)
+    except OSError:
+        print("WARNING: cannot write sample manifest", file=sys.stderr)
+
+    return None
+
+
+def distribution_columns_parse(registry, valid_OTUs, lines):
+    """
+    Sum amplicon abundances per seed, one sample after the other.
+    """
+    # distribution files list samples one after the other: yield
+    # each run of lines of the same sample as a column (sample name,
+    # seed rows, counts)
+    previous_sample = None
+    column = dict()
+    for line in lines:
+        amplicon, sample, abundance = line.strip().split(b"\t")
+        if sample != previous_sample:
+            if previous_sample is not None:
+                yield (previous_sample.decode("utf-8"),
+                       array("I", column.keys()),
+                       array("Q", column.values()))
+            previous_sample = sample
+            column = dict()
+        seed_row = valid_OTUs.get(registry.get(amplicon))
+        if seed_row is not None:
+            abundance = int(abundance)
+            if abundance > 0:
+                # update the seed distribution directly
+                column[seed_row] = column.get(seed_row, 0) + abundance
+    if previous_sample is not None:
+        yield (previous_sample.decode("utf-8"),
+               array("I", column.keys()),
+               array("Q", column.values()))
+
+
+def distribution_chunks(distr, number_of_chunks):
+    """
+    Split a distribution file in chunks of whole lines (byte offsets).
+    """
+    size = os.path.getsize(distr)
+    offsets = [0]
+    with open(distr, "rb") as distr_file:
+        for i in range(1, number_of_chunks):
+            distr_file.seek(max(size * i // number_of_chunks, offsets[-1]))
+            distr_file.readline()  # move to the start of the next line
+            offsets.append(min(distr_file.tell(), size))
+    offsets.append(size)
+
+    return [(start, end) for start, end in zip(offsets[:-1], offsets[1:])
+            if start < end]
+
+
+def distribution_chunk_lines(distr, start, end):
+    """
+    Read lines from a chunk of a distribution file.
+    """
+    with open(distr, "rb") as distr_file:
+        distr_file.seek(start)
+        position = start
+        for line in distr_file:
+            if position >= end:
+                break
+            position += len(line)
+            yield line
+
+
+def distribution_chunk_worker(distr, start, end):
+    """
+    Parse a chunk of a distribution file in a worker process.
+    """
+    lines = distribution_chunk_lines(distr, start, end)
+
+    return list(distribution_columns_parse(SHARED["registry"],
+                                           SHARED["valid_OTUs"], lines))
+
+
+def distribution_parse(registry, valid_OTUs, distr, threads):
     # "${DISTRIBUTION}"
     """
     Map amplicon ids, abundances and samples.
     """
     distr_file = distr
-    samples = dict()
-    # initialize the seed to sample dict
-    seeds2samples = [dict() for i in range(0, 256)]
-    seeds = list()
-    for i in range(0, 256):
-        seeds += list(valid_OTUs[i].values())
-    for seed in set(seeds):
-        index = int(seed[0:2], 16)
-        seeds2samples[index][seed] = dict()
-
-    with open(distr_file, "r") as distr_file:
-        print("PROGRESS: parsing distribution file", file=sys.stderr)
-        for line in distr_file:
-            amplicon, sample, abundance = line.strip().split("\t")
-            # deal with duplicated samples
-            samples[sample] = samples.get(sample, 0) + 1
-            index = int(amplicon[0:2], 16)
-            if amplicon in valid_OTUs[index]:
-                abundance = int(abundance)
-                # update the seed distribution directly
-                seed = valid_OTUs[index][amplicon]
-                index = int(seed[0:2], 16)
-                seeds2samples[index][seed][sample] = (
-                    seeds2samples[index][seed].get(sample, 0)
-                    + abundance)
-        samples = sorted(samples.keys())
+    # give each seed a dense row id in the count matrix, and point
+    # amplicons directly to their seed's row (in place)
+    seed_rows = dict()
+    for amplicon_id, seed_id in valid_OTUs.items():
+        valid_OTUs[amplicon_id] = seed_rows.setdefault(seed_id,
+                                                       len(seed_rows))
+    seeds2samples = SeedSampleMatrix(len(seed_rows))
+
+    # use the binary index of the distribution file, if any (see
+    # distribution_index.py): no text parsing, amplicons are fetched
+    # directly from memory-mapped arrays
+    index = distribution_index_load(distr)
+    if index is not None:
+        print("PROGRESS: reading distribution index", file=sys.stderr)
+        rows = [dict() for seed_row in range(len(seed_rows))]
+        for amplicon_id, seed_row in valid_OTUs.items():
+            sample_ids, counts = index.get(registry.digest(amplicon_id))
+            row = rows[seed_row]
+            for sample_id, count in zip(sample_ids, counts):
+                row[sample_id] = row.get(sample_id, 0) + count
+        seeds2samples.fill_rows(rows, len(index.samples))
+        return seeds2samples, seed_rows, index.samples
+
+    # samples are interned once as dense integer ids (matrix columns)
+    samples = samples_manifest_parse(distr)
+    manifest = list(samples.keys())
+    observed_samples = set()
+
+    print("PROGRESS: parsing distribution file", file=sys.stderr)
+    # compressed files and pipes cannot be cut in chunks
+    if (threads < 2 or not os.path.isfile(distr)
+            or is_compressed(distr)):
+        with open_input(distr_file, "rb") as distr_file:
+            columns = distribution_columns_parse(registry, valid_OTUs,
+                                                 distr_file)
+            for sample, seed_ids, counts in columns:
+                # deal with duplicated samples
+                sample_id = samples.setdefault(sample, len(samples))
+                observed_samples.add(sample_id)
+                seeds2samples.add_column(sample_id, seed_ids, counts)
+    else:
+        # map: parse chunks of whole lines in forked processes; reduce:
+        # merge columns in file order (a sample cut by a chunk
+        # boundary is summed like a duplicated sample)
+        chunks = distribution_chunks(distr, 4 * threads)
+        with ProcessPoolExecutor(max_workers=threads,
+                                 mp_context=get_context("fork"),
+                                 initializer=share_with_workers,
+                                 initargs=({"registry": registry,
+                                            "valid_OTUs": valid_OTUs},)
+                                 ) as executor:
+            jobs = [executor.submit(distribution_chunk_worker,
+                                    distr, start, end)
+                    for start, end in chunks]
+            for job in jobs:
+                for sample, seed_ids, counts in job.result():
+                    sample_id = samples.setdefault(sample, len(samples))
+                    observed_samples.add(sample_id)
+                    seeds2samples.add_column(sample_id, seed_ids, counts)
+
+    if len(observed_samples) == len(samples) == len(manifest):
+        # all samples are listed in the manifest, and nothing else:
+        # manifest ids are already column ids (sorted sample names)
+        sorted_samples = manifest
+        sample_order = range(len(manifest))
+    else:
+        # samples absent from the distribution file are not listed
+        sorted_samples = sorted([sample for sample, sample_id
+                                 in samples.items()
+                                 if sample_id in observed_samples])
+        samples_manifest_write(distr, sorted_samples)
+        sample_order = [samples[sample] for sample in sorted_samples]
+    seeds2samples.compress(sample_order)
 
-    return seeds2samples, samples
+    return seeds2samples, seed_rows, sorted_samples
 
 
-def print_table(representatives, stats, sorted_stats,
-                swarms, uchime, seeds2samples,
-                samples, quality, seeds, stampa, EE_threshold):
+def distribution_snapshot_load(registry, representatives, swarm, distr,
+                               cache_dir):
+    """
+    Get the cache key of a distribution, and the cached result if any.
+    """
+    if cache_dir is None:
+        return None, None
+    # seeds (and the swarms file) decide which amplicons are counted
+    key = cache_key("distribution", SNAPSHOT_VERSION,
+                    file_fingerprint(distr), *map(file_fingerprint, swarm),
+                    digests_fingerprint(map(registry.digest,
+                                            representatives)))
+    snapshot = cache_load(cache_dir, key)
+    if snapshot is None:
+        return key, None
+
+    print("PROGRESS: loading cached distribution", file=sys.stderr)
+    seeds = snapshot["seeds"]
+    seed_rows = dict()
+    for seed_row in range(0, len(seeds) // 20):
+        digest = seeds[20 * seed_row:20 * seed_row + 20].tobytes()
+        seed_rows[registry.get_digest(digest)] = seed_row
+    samples = snapshot["samples"].tobytes().decode("utf-8")
+    samples = samples.split("\n") if samples else list()
+    seeds2samples = SeedSampleMatrix(len(seed_rows))
+    seeds2samples.indptr = snapshot["indptr"]
+    seeds2samples.indices = snapshot["indices"]
+    seeds2samples.data = snapshot["data"]
+    seeds2samples.number_of_samples = len(samples)
+
+    return key, (seeds2samples, seed_rows, samples)
+
+
+def distribution_snapshot_store(registry, key, distribution,
+                                cache_dir, cache_size):
+    """
+    Store a parsed distribution in the cache.
+    """
+    seeds2samples, seed_rows, samples = distribution
+    # seed rows are attributed in order
+    cache_store(cache_dir, key,
+                {"seeds": b"".join(map(registry.digest, seed_rows)),
+                 "indptr": seeds2samples.indptr,
+                 "indices": seeds2samples.indices,
+                 "data": seeds2samples.data,
+                 "samples": "\n".join(samples).encode("utf-8")},
+                cache_size)
+
+    return None
+
+
+def table_writer(table_format, output, samples, metadata=None, counts=None,
+                 threads=1):
+    """
+    Open a table writer (output is a file name, or None for stdout).
+    """
+    # text outputs named *.gz are compressed in parallel (BGZF)
+    if table_format in FILE_FORMATS:
+        output_file = output
+    elif output is None:
+        output_file = sys.stdout
+    else:
+        output_file = open_output(output, threads)
+
+    if table_format == "hdf5":
+        table = BiomHDF5Writer(output_file, samples)
+    elif table_format == "columnar":
+        table = ColumnarTableWriter(output_file, samples)
+    elif table_format == "sqlite":
+        table = SQLiteWriter(output_file, samples)
+    elif table_format == "biom":
+        table = BiomWriter(output_file, samples)
+    elif table_format == "long":
+        table = LongTableWriter(output_file, samples)
+        # OTU metadata are not in long tables
+        if metadata is None and output.endswith(".gz"):
+            metadata = output[:-len(".gz")] + ".metadata.gz"
+        elif metadata is None:
+            metadata = output + ".metadata"
+    else:
+        table = TableWriter(output_file, samples)
+
+    if metadata is None and counts is None:
+        return table
+    if metadata is not None:
+        metadata = open_output(metadata, threads)
+    if counts is not None:
+        counts = open_output(counts, threads)
+
+    return SplitTableWriter(table, samples, metadata, counts)
+
+
+def print_table(registry, representatives, stats, sorted_stats,
+                swarms, uchime, seeds2samples, seed_rows,
+                samples, quality, seeds, stampa, EE_threshold,
+                min_abundance, min_spread, output, table_format,
+                metadata=None, counts=None, threads=1):
     """
     Export results.
     """
     print("PROGRESS: filtering and writing OTUs", file=sys.stderr)
-    # Print table header
-    print("OTU", "total", "cloud",
-          "amplicon", "length", "abundance",
-          "chimera", "spread", "quality",
-          "sequence", "identity", "taxonomy", "references",
-          "\t".join(samples),
-          sep="\t", file=sys.stdout)
+    table = table_writer(table_format, output, samples, metadata, counts,
+                         threads)
+
+    # Spreads and number of reads of all OTUs
+    spreads = seeds2samples.row_spreads()
+    totals = seeds2samples.row_totals()
 
     # Print table content
     i = 1
-    for seed, abundance in sorted_stats:
-        index = int(seed[0:2], 16)
-        sequence = representatives[index][seed]
-        occurrences = dict([(sample, 0) for sample in samples])
+    reads = 0
+    for seed_id, abundance in sorted_stats:
         try:
-            occurrences.update(seeds2samples[index][seed])
+            seed_row = seed_rows[seed_id]
         except KeyError:
             # In rare cases, the cleaving step can change the seed of
             # a cluster (for example, when one or more amplicons have
@@ -294,43 +1330,89 @@ def print_table(representatives, stats, sorted_stats,
             # seed. Not skipping creates an empty cluster (zero reads)
             # with the original seed. Empty clusters should be
             # discarded by downstream analyses, but skipping is much
-            # cleaner.
+            # cleaner. Seeds discarded by plan_filters are skipped
+            # too, they cannot pass the filters below.
             continue
-        spread = len([occurrences[sample] for sample in samples
-                      if occurrences[sample] > 0])
-        sequence_abundance, cloud = seeds[seed]
+        spread = spreads[seed_row]
+        sequence_abundance, cloud = seeds[seed_id]
 
         # Quality (note: more digits with python 3)
-        if seed in quality:
-            high_quality = quality[seed]
+        if seed_id in quality:
+            high_quality = quality[seed_id]
         else:
             high_quality = "NA"
 
         # Chimera checking (deal with incomplete cases. Is it useful?)
-        if seed in uchime:
-            chimera_status = uchime[seed]
+        if seed_id in uchime:
+            chimera_status = uchime[seed_id]
         else:
             chimera_status = "NA"
 
         # Taxonomic assignment
-        if seed in stampa[index]:
-            identity, taxonomy, references = stampa[index][seed]
+        if seed_id in stampa:
+            identity, taxonomy, references = stampa[seed_id]
         else:
             identity, taxonomy, references = "NA", "NA", "NA"
 
         # Apply filters
         if (chimera_status == "N" and
                 high_quality <= EE_threshold
-                and (abundance >= 3 or spread >= 2)):
-            print(i, abundance, cloud,
-                  seed, len(sequence), sequence_abundance,
-                  chimera_status, spread, high_quality, sequence,
-                  identity, taxonomy, references,
-                  "\t".join([str(occurrences[sample]) for sample in samples]),
-                  sep="\t", file=sys.stdout)
+                and (abundance >= min_abundance or spread >= min_spread)):
+            # sequences are only read for the OTUs written
+            sequence = representatives[seed_id]
+            sample_ids, counts = seeds2samples.row(seed_row)
+            table.write_row((i, abundance, cloud,
+                             registry.name(seed_id), len(sequence),
+                             sequence_abundance, chimera_status, spread,
+                             high_quality, sequence,
+                             identity, taxonomy, references),
+                            sample_ids, counts)
+            reads += totals[seed_row]
             i += 1
+    table.close()
+    print("PROGRESS: wrote", i - 1, "OTUs and", reads, "reads",
+          file=sys.stderr)
 
-    return
+    return i - 1, reads
+
+
+def sweep_tables(registry, representatives, stats, sorted_stats,
+                 swarms, uchime, seeds2samples, seed_rows,
+                 samples, quality, seeds, stampa, EE_thresholds,
+                 min_abundances, min_spreads, sweep_prefix, table_format,
+                 metadata, counts, threads):
+    """
+    Export one table per combination of filter values.
+    """
+    summary_file = sweep_prefix + ".sweep"
+    with open(summary_file, "w") as summary_file:
+        print("EE_threshold", "min_abundance", "min_spread",
+              "OTUs", "reads", "table",
+              sep="\t", file=summary_file)
+        for EE_threshold, min_abundance, min_spread in itertools.product(
+                EE_thresholds, min_abundances, min_spreads):
+            table_file = (sweep_prefix
+                          + "_EE" + str(EE_threshold)
+                          + "_abundance" + str(min_abundance)
+                          + "_spread" + str(min_spread)
+                          + TABLE_EXTENSIONS[table_format])
+            # metadata and count-matrix tables are named after the table
+            if metadata is not None:
+                metadata = table_file + ".metadata"
+            if counts is not None:
+                counts = table_file + ".counts"
+            OTUs, reads = print_table(registry, representatives, stats,
+                                      sorted_stats, swarms, uchime,
+                                      seeds2samples, seed_rows, samples,
+                                      quality, seeds, stampa,
+                                      EE_threshold, min_abundance,
+                                      min_spread, table_file, table_format,
+                                      metadata, counts, threads)
+            print(EE_threshold, min_abundance, min_spread,
+                  OTUs, reads, table_file,
+                  sep="\t", file=summary_file)
+
+    return None
 
 
 def main():
@@ -338,33 +1420,64 @@ def main():
     Read swarm files and build a sorted OTU contingency table.
     """
     # Parse arguments from command line
-    repre, stat, swarm, chime, qual, assign, distr, EE_threshold = arg_parse()
+    (repre, stat, swarm, chime, qual, assign, distr, EE_thresholds,
+     min_abundances, min_spreads, output, metadata, counts, table_format,
+     sweep_prefix, cache_dir, cache_size, threads) = arg_parse()
+
+    # Amplicon names are resolved once into integer ids
+    registry = AmpliconRegistry()
 
     # Parse taxonomic assignment results (i.e. valid OTUs for the final table)
-    stampa = stampa_parse(assign)
+    stampa = stampa_parse(registry, assign)
 
     # Parse OTU representatives
-    representatives = representatives_parse(stampa, repre)
-
-    # Parse OTU stats
-    stats, sorted_stats, seeds = stats_parse(representatives, stat)
+    representatives = representatives_cached_parse(registry, stampa, repre,
+                                                   cache_dir, cache_size)
 
-    # Parse OTUs (swarms)
-    swarms, valid_OTUs = swarms_parse(representatives, swarm)
+    # Load the distribution from the cache, if possible (OTU members
+    # are then not needed: skip the swarms file)
+    distribution_key, distribution = distribution_snapshot_load(
+        registry, representatives, swarm, distr, cache_dir)
+    if distribution is not None:
+        swarm = None
 
-    # Parse chimera detection results (uchime)
-    uchime = uchime_parse(representatives, chime)
+    # Parse OTU stats, OTUs (swarms), chimera detection results
+    # (uchime) and sequence's best error rates (a.k.a. quality)
+    ((stats, sorted_stats, seeds),
+     (swarms, valid_OTUs),
+     uchime,
+     quality) = seeds_parse(registry, representatives,
+                            stat, swarm, chime, qual, threads)
 
-    # Parse sequence's best error rates (a.k.a. quality)
-    quality = quality_parse(representatives, qual)
+    if distribution is None:
+        # Discard OTUs that cannot pass the chimera and quality
+        # filters (for any of the quality thresholds). Cached
+        # distributions cover all OTUs, so that they can be reused
+        # with other thresholds.
+        if cache_dir is None:
+            valid_OTUs = plan_filters(valid_OTUs, uchime, quality,
+                                      max(EE_thresholds))
 
-    # Parse distribution file
-    seeds2samples, samples = distribution_parse(valid_OTUs, distr)
+        # Parse distribution file
+        distribution = distribution_parse(registry, valid_OTUs, distr,
+                                          threads)
+        distribution_snapshot_store(registry, distribution_key, distribution,
+                                    cache_dir, cache_size)
+    seeds2samples, seed_rows, samples = distribution
 
-    # Print table header
-    print_table(representatives, stats, sorted_stats, swarms,
-                uchime, seeds2samples, samples, quality,
-                seeds, stampa, EE_threshold)
+    # Print table(s)
+    if sweep_prefix is None:
+        print_table(registry, representatives, stats, sorted_stats, swarms,
+                    uchime, seeds2samples, seed_rows, samples, quality,
+                    seeds, stampa, EE_thresholds[0], min_abundances[0],
+                    min_spreads[0], output, table_format, metadata, counts,
+                    threads)
+    else:
+        sweep_tables(registry, representatives, stats, sorted_stats, swarms,
+                     uchime, seeds2samples, seed_rows, samples, quality,
+                     seeds, stampa, EE_thresholds, min_abundances,
+                     min_spreads, sweep_prefix, table_format, metadata,
+                     counts, threads)
 
     return
 
@@ -11,6 +11,10 @@ __version__ = "$Revision: 2.0"
 import sys
 import argparse
 
+from amplicon_registry import AmpliconRegistry
+from columnar_table import columnar_table_open
+from compressed_io import open_input, open_output
+
 
 # *************************************************************************** #
 #                                                                             #
@@ -28,7 +32,7 @@ if __name__ == '__main__':
     parser.add_argument("--old_otu_table",
                         dest="old_otu_table",
                         required=True,
-                        help="old OTU table")
+                        help="old OTU table (tsv or columnar)")
 
     parser.add_argument("--new_taxonomy",
                         dest="new_taxonomy_file",
@@ -38,30 +42,52 @@ if __name__ == '__main__':
     parser.add_argument("--new_otu_table",
                         dest="new_otu_table",
                         required=True,
-                        help="new OTU table")
+                        help="new OTU table (block-compressed if its name "
+                        "ends with .gz)")
+
+    parser.add_argument("-t", "--threads",
+                        dest="threads",
+                        type=int,
+                        default=1,
+                        help="number of compression threads")
 
     ARGS = parser.parse_args()
 
 
-def parse_taxonomy(new_taxonomy_file):
+def parse_taxonomy(registry, new_taxonomy_file):
     """
     Map amplicons and taxonomic assignments.
     """
     separator = "\t"
-    amplicons = [dict() for i in range(0, 256)]
+    amplicons = dict()
 
-    with open(new_taxonomy_file, "r") as new_taxonomy_data:
+    with open_input(new_taxonomy_file) as new_taxonomy_data:
         print("PROGRESS: parsing taxonomy", file=sys.stderr)
         for line in new_taxonomy_data:
             amplicon, abundance, identity, taxonomy, references = \
                 line.strip().split(separator)
-            index = int(amplicon[0:2], 16)
-            amplicons[index][amplicon] = (identity, taxonomy, references)
+            amplicons[registry.add(amplicon)] = (identity, taxonomy,
+                                                 references)
 
     return amplicons
 
 
-def update_otu_table(old_otu_table, amplicons, new_otu_table):
+def otu_table_rows(old_otu_table):
+    """
+    Yield rows of a tsv or binary columnar OTU table (header first).
+    """
+    separator = "\t"
+    table = columnar_table_open(old_otu_table)
+    if table is not None:
+        yield from table.tsv_rows()
+        return
+    with open_input(old_otu_table) as old_otu_data:
+        for line in old_otu_data:
+            yield line.strip().split(separator)
+
+
+def update_otu_table(registry, old_otu_table, amplicons, new_otu_table,
+                     threads):
     """
     Update taxonomy, identity and references.
 
@@ -80,26 +106,22 @@ def update_otu_table(old_otu_table, amplicons, new_otu_table):
     12	taxonomy
     13	references
     """
-    separator = "\t"
     is_first_line = True
-    with open(old_otu_table, "r") as old_otu_data:
-        with open(new_otu_table, "w") as new_otu_file:
-            print("PROGRESS: parsing and updating old OTU table",
-                  file=sys.stderr)
-            for line in old_otu_data:
-                line = line.strip().split(separator)
-
-                # header line is printed as-is
-                if is_first_line:
-                    is_first_line = False
-                    print("\t".join(line), file=new_otu_file)
-                    continue
-
-                # update identity, taxonomy and references
-                amplicon = line[3]
-                index = int(amplicon[0:2], 16)
-                line[10], line[11], line[12] = amplicons[index][amplicon]
+    with open_output(new_otu_table, threads) as new_otu_file:
+        print("PROGRESS: parsing and updating old OTU table",
+              file=sys.stderr)
+        for line in otu_table_rows(old_otu_table):
+
+            # header line is printed as-is
+            if is_first_line:
+                is_first_line = False
                 print("\t".join(line), file=new_otu_file)
+                continue
+
+            # update identity, taxonomy and references
+            amplicon_id = registry[line[3]]
+            line[10], line[11], line[12] = amplicons[amplicon_id]
+            print("\t".join(line), file=new_otu_file)
 
 
 def main():
@@ -110,15 +132,20 @@ def main():
     old_otu_table = ARGS.old_otu_table
     new_taxonomy_file = ARGS.new_taxonomy_file
     new_otu_table = ARGS.new_otu_table
+    threads = ARGS.threads
+
+    # amplicon names are resolved once into integer ids
+    registry = AmpliconRegistry()
 
     # Parse the new taxomomic results
-    amplicons = parse_taxonomy(new_taxonomy_file)
+    amplicons = parse_taxonomy(registry, new_taxonomy_file)
 
     # Sort by decreasing abundance (and alphabetical name? no)
     # not possible as-of-now, old table must be memoized first...
 
     # Parse the old OTU table and write a new one
-    update_otu_table(old_otu_table, amplicons, new_otu_table)
+    update_otu_table(registry, old_otu_table, amplicons, new_otu_table,
+                     threads)
 
 
 # *************************************************************************** #
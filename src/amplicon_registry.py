@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   map SHA1 amplicon names to dense integer ids
+"""
+
+__author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
+__date__ = "2026/10/17"
+__version__ = "$Revision: 1.0"
+
+import binascii
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+
+class AmpliconRegistry:
+    """
+    Map SHA1 amplicon names to dense integer ids.
+
+    Amplicon names (40 hexadecimal characters, str or bytes) are
+    stored as 20-byte binary digests in a single hash table (python
+    dicts are compact open-addressing tables). Ids are attributed in
+    order of registration, and can be used to index lists or arrays.
+
+    Names must be lowercase SHA1 values: digests are converted back
+    to lowercase names, so uppercase names would not be written back
+    unchanged.
+    """
+
+    def __init__(self):
+        self.ids = dict()
+        self.digests = list()
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __contains__(self, amplicon):
+        return self.get(amplicon) is not None
+
+    def __getitem__(self, amplicon):
+        return self.ids[binascii.unhexlify(amplicon)]
+
+    def get(self, amplicon, default=None):
+        """
+        Return the id of an amplicon, or default if not registered.
+        """
+        try:
+            digest = binascii.unhexlify(amplicon)
+        except ValueError:  # not a SHA1 name (truncated lines, non-ASCII)
+            return default
+        return self.ids.get(digest, default)
+
+    def get_digest(self, digest, default=None):
+        """
+        Return the id of a binary digest, or default if not registered.
+        """
+        return self.ids.get(digest, default)
+
+    def add(self, amplicon):
+        """
+        Register an amplicon (if need be) and return its id.
+        """
+        digest = binascii.unhexlify(amplicon)
+        amplicon_id = self.ids.get(digest)
+        if amplicon_id is None:
+            amplicon_id = len(self.digests)
+            self.ids[digest] = amplicon_id
+            self.digests.append(digest)
+        return amplicon_id
+
+    def digest(self, amplicon_id):
+        """
+        Return the binary digest of an amplicon (same order as names).
+        """
+        return self.digests[amplicon_id]
+
+    def name(self, amplicon_id):
+        """
+        Return the SHA1 name of an amplicon.
+        """
+        return binascii.hexlify(self.digests[amplicon_id]).decode("ascii")
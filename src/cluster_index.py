@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   index clusters in swarms and struct files (byte offsets)
+
+   Building the index costs a full parse of both files, and holds all
+   amplicon digests in memory: it only pays off when the cleaver runs
+   several times on the same files (the cleaver uses a valid index
+   when there is one, and never builds it itself).
+"""
+
+__author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
+__date__ = "2026/10/17"
+__version__ = "$Revision: 1.0"
+
+import os
+import re
+import sys
+import bisect
+import binascii
+from argparse import ArgumentParser
+from array import array
+
+from compressed_io import is_compressed
+from distribution_index import DigestView
+from snapshot_cache import file_fingerprint, snapshot_read, snapshot_write
+
+
+# amplicon and abundance in swarm lines ("name;size=123" or "name_123")
+SWARM_TOKEN = re.compile(rb"([^\s_;]+)(?:_|;size=)([0-9]+);?")
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+
+class ClusterIndex:
+    """
+    Locate clusters in swarms and struct files.
+
+    Swarms clusters are numbered by line (from 0), and each amplicon
+    points to the line of its cluster. Struct clusters are listed in
+    file order, with their cluster id, their root (father of their
+    first link) and their byte range.
+    """
+
+    def __init__(self, arrays):
+        self.members = DigestView(arrays["members"])
+        self.member_lines = arrays["member_lines"]
+        self.line_offsets = arrays["line_offsets"]
+        self.line_seeds = DigestView(arrays["line_seeds"])
+        self.cluster_ids = arrays["cluster_ids"]
+        self.struct_starts = arrays["struct_starts"]
+        self.struct_ends = arrays["struct_ends"]
+        self.roots = DigestView(arrays["roots"])
+        self.sorted_roots = DigestView(arrays["sorted_roots"])
+        self.root_order = arrays["root_order"]
+        self.struct_size = arrays["struct_size"][0]
+
+    def line_of(self, digest):
+        """
+        Return the swarms line of an amplicon (binary digest), or None.
+        """
+        k = bisect.bisect_left(self.members, digest)
+        if k == len(self.members) or self.members[k] != digest:
+            return None
+        return self.member_lines[k]
+
+    def line_range(self, line):
+        """
+        Return the byte range of a swarms line.
+        """
+        return self.line_offsets[line], self.line_offsets[line + 1]
+
+    def struct_cluster_of(self, root):
+        """
+        Return the struct cluster rooted in an amplicon, or None.
+        """
+        k = bisect.bisect_left(self.sorted_roots, root)
+        if k == len(self.sorted_roots) or self.sorted_roots[k] != root:
+            return None
+        return self.root_order[k]
+
+    def struct_cluster_by_id(self, cluster_id):
+        """
+        Return the struct cluster with a given cluster id, or None.
+        """
+        k = bisect.bisect_left(self.cluster_ids, cluster_id)
+        if k == len(self.cluster_ids) or self.cluster_ids[k] != cluster_id:
+            return None
+        return k
+
+    def struct_range(self, k):
+        """
+        Return the byte range of a struct cluster.
+        """
+        return self.struct_starts[k], self.struct_ends[k]
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                  Functions                                  #
+#                                                                             #
+# *************************************************************************** #
+
+def arg_parse():
+    """
+    Parse arguments from command line.
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument("-s", "--swarms",
+                        action="store",
+                        dest="swarms",
+                        required=True)
+
+    parser.add_argument("-t", "--struct",
+                        action="store",
+                        dest="struct",
+                        required=True)
+
+    args = parser.parse_args()
+
+    return args.swarms, args.struct
+
+
+def swarm_tokens(line):
+    """
+    Yield amplicon and abundance pairs of a swarm line (bytes).
+    """
+    for match in SWARM_TOKEN.finditer(line):
+        yield match.groups()
+
+
+def cluster_index_write(swarms_file, struct_file):
+    """
+    Locate clusters and amplicons in swarms and struct files, write an index.
+    """
+    members = dict()
+    line_offsets = array("Q", [0])
+    line_seeds = list()
+    with open(swarms_file, "rb") as input_file:
+        print("PROGRESS: indexing swarms file", swarms_file, file=sys.stderr)
+        for line_number, line in enumerate(input_file):
+            seed = None
+            for amplicon, abundance in swarm_tokens(line):
+                digest = binascii.unhexlify(amplicon)
+                members[digest] = line_number
+                if seed is None:  # first amplicon
+                    seed = digest
+            line_seeds.append(seed or bytes(20))
+            line_offsets.append(line_offsets[-1] + len(line))
+
+    cluster_ids = array("I")
+    struct_starts = array("Q")
+    struct_ends = array("Q")
+    roots = list()
+    offset = 0
+    with open(struct_file, "rb") as input_file:
+        print("PROGRESS: indexing struct file", struct_file, file=sys.stderr)
+        for line in input_file:
+            father, son, diffs, cluster_id, steps = line.strip().split(b"\t")
+            cluster_id = int(cluster_id)
+            if not cluster_ids or cluster_id != cluster_ids[-1]:
+                if cluster_ids:
+                    struct_ends.append(offset)
+                cluster_ids.append(cluster_id)
+                struct_starts.append(offset)
+                roots.append(binascii.unhexlify(father))
+            offset += len(line)
+    if cluster_ids:
+        struct_ends.append(offset)
+
+    sorted_members = sorted(members)
+    root_order = sorted(range(len(roots)), key=roots.__getitem__)
+    index_file = swarms_file + ".idx"
+    snapshot_write(index_file + ".tmp",
+                   {"source": (file_fingerprint(swarms_file) + " "
+                               + file_fingerprint(struct_file)
+                               ).encode("ascii"),
+                    "members": b"".join(sorted_members),
+                    "member_lines": array("I", [members[digest] for digest
+                                                in sorted_members]),
+                    "line_offsets": line_offsets,
+                    "line_seeds": b"".join(line_seeds),
+                    "cluster_ids": cluster_ids,
+                    "struct_starts": struct_starts,
+                    "struct_ends": struct_ends,
+                    "roots": b"".join(roots),
+                    "sorted_roots": b"".join([roots[k]
+                                              for k in root_order]),
+                    "root_order": array("I", root_order),
+                    "struct_size": array("Q", [offset])})
+    os.replace(index_file + ".tmp", index_file)
+    print("PROGRESS: indexed", len(line_seeds), "clusters and",
+          len(sorted_members), "amplicons", file=sys.stderr)
+
+    return None
+
+
+def cluster_index_load(swarms_file, struct_file):
+    """
+    Map the cluster index of swarms and struct files, or return None.
+    """
+    # pipes and compressed files cannot be read at random
+    fingerprints = (file_fingerprint(swarms_file),
+                    file_fingerprint(struct_file))
+    if None in fingerprints or is_compressed(swarms_file) \
+       or is_compressed(struct_file):
+        return None
+    try:
+        arrays = snapshot_read(swarms_file + ".idx")
+    except (OSError, ValueError):  # no index
+        return None
+    # an index built from other versions of the files is obsolete
+    if arrays["source"].tobytes().decode("ascii") != " ".join(fingerprints):
+        return None
+
+    return ClusterIndex(arrays)
+
+
+def main():
+    """
+    Index clusters of swarms and struct files.
+    """
+    cluster_index_write(*arg_parse())
+
+    return
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                     Body                                    #
+#                                                                             #
+# *************************************************************************** #
+
+if __name__ == '__main__':
+
+    main()
+
+    sys.exit(0)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   write and read occurrence tables in a binary columnar format
+"""
+
+__author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
+__date__ = "2026/10/17"
+__version__ = "$Revision: 1.0"
+
+from array import array
+from collections import Counter
+
+from snapshot_cache import snapshot_read, snapshot_write
+
+
+FORMAT = b"occurrence table 1"
+
+# metadata columns of the occurrence table (followed by samples)
+COLUMNS = ("OTU", "total", "cloud",
+           "amplicon", "length", "abundance",
+           "chimera", "spread", "quality",
+           "sequence", "identity", "taxonomy", "references")
+
+# numerical columns (other columns are strings)
+TYPECODES = {"OTU": "Q",
+             "total": "Q",
+             "cloud": "Q",
+             "length": "Q",
+             "abundance": "Q",
+             "spread": "Q",
+             "quality": "d"}
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+
+class ColumnarTableWriter:
+    """
+    Writer of binary columnar occurrence tables.
+
+    Each metadata column is a flat array (strings are concatenated,
+    with an offset table). Counts are stored twice, as compressed
+    sparse rows (OTUs) and columns (samples). The file uses the
+    snapshot format (see snapshot_cache.py), and can be mapped in
+    memory by ColumnarTable.
+    """
+
+    def __init__(self, output, samples):
+        self.output = output
+        self.samples = samples
+        self.columns = dict()
+        for column in COLUMNS:
+            if column in TYPECODES:
+                self.columns[column] = array(TYPECODES[column])
+            else:
+                self.columns[column] = (array("Q", [0]), list())
+        self.indptr = array("Q", [0])
+        self.indices = array("I")
+        self.data = array("Q")
+
+    def write_row(self, fields, sample_ids, counts):
+        """
+        Buffer the metadata and the non-zero counts of an OTU.
+        """
+        for column, field in zip(COLUMNS, fields):
+            if column == "quality" and field == "NA":
+                field = float("nan")
+            if column in TYPECODES:
+                self.columns[column].append(field)
+            else:
+                offsets, strings = self.columns[column]
+                field = str(field).encode("utf-8")
+                offsets.append(offsets[-1] + len(field))
+                strings.append(field)
+        self.indices.extend(sample_ids)
+        self.data.extend(counts)
+        self.indptr.append(len(self.indices))
+
+    def close(self):
+        """
+        Write the table.
+        """
+        arrays = {"format": FORMAT,
+                  "samples": "\n".join(self.samples).encode("utf-8")}
+        for column, values in self.columns.items():
+            if column in TYPECODES:
+                arrays[column] = values
+            else:
+                offsets, strings = values
+                arrays[column + ".offsets"] = offsets
+                arrays[column + ".strings"] = b"".join(strings)
+        arrays["indptr"] = self.indptr
+        arrays["indices"] = self.indices
+        arrays["data"] = self.data
+        (arrays["column_indptr"],
+         arrays["column_indices"],
+         arrays["column_data"]) = sparse_transpose(
+             self.indptr, self.indices, self.data, len(self.samples))
+        snapshot_write(self.output, arrays)
+
+
+class StringColumn:
+    """
+    Read-only sequence of strings (concatenated, with offsets).
+    """
+
+    def __init__(self, offsets, strings):
+        self.offsets = offsets
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.strings[self.offsets[i]:self.offsets[i + 1]].tobytes(
+            ).decode("utf-8")
+
+
+class ColumnarTable:
+    """
+    Memory-mapped binary columnar occurrence table.
+
+    Columns, rows and sample counts are read on demand, the file is
+    never loaded as a whole.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        samples = arrays["samples"].tobytes().decode("utf-8")
+        self.samples = samples.split("\n") if samples else list()
+        self.columns = dict()
+        for column in COLUMNS:
+            if column in TYPECODES:
+                self.columns[column] = arrays[column]
+            else:
+                self.columns[column] = StringColumn(
+                    arrays[column + ".offsets"], arrays[column + ".strings"])
+
+    def __len__(self):
+        return len(self.arrays["indptr"]) - 1
+
+    def column(self, name, start=0, end=None):
+        """
+        Return a slice of a metadata column.
+        """
+        values = self.columns[name][start:end]
+        if name == "quality":  # missing values are stored as NaN
+            values = [value if value == value else "NA" for value in values]
+        return values
+
+    def row(self, i):
+        """
+        Return the metadata fields of the i-th OTU.
+        """
+        fields = [self.columns[column][i] for column in COLUMNS]
+        quality = COLUMNS.index("quality")
+        if fields[quality] != fields[quality]:
+            fields[quality] = "NA"
+        return tuple(fields)
+
+    def counts(self, i):
+        """
+        Return sample ids and non-zero counts of the i-th OTU.
+        """
+        indptr = self.arrays["indptr"]
+        start, end = indptr[i], indptr[i + 1]
+        return self.arrays["indices"][start:end], self.arrays["data"][start:end]
+
+    def dense_counts(self, i):
+        """
+        Return the counts of the i-th OTU in all samples.
+        """
+        counts = [0] * len(self.samples)
+        for sample_id, count in zip(*self.counts(i)):
+            counts[sample_id] = count
+        return counts
+
+    def sample_counts(self, sample_id):
+        """
+        Return OTU rows and non-zero counts of a sample.
+        """
+        indptr = self.arrays["column_indptr"]
+        start, end = indptr[sample_id], indptr[sample_id + 1]
+        return (self.arrays["column_indices"][start:end],
+                self.arrays["column_data"][start:end])
+
+    def tsv_rows(self):
+        """
+        Yield rows as lists of strings, as in a tsv table (header first).
+        """
+        yield list(COLUMNS) + self.samples
+        for i in range(len(self)):
+            yield (list(map(str, self.row(i)))
+                   + list(map(str, self.dense_counts(i))))
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                  Functions                                  #
+#                                                                             #
+# *************************************************************************** #
+
+def sparse_transpose(indptr, indices, data, number_of_columns):
+    """
+    Transpose compressed sparse rows into compressed sparse columns.
+    """
+    column_lengths = Counter(indices)
+    column_indptr = array("Q", [0])
+    for column in range(number_of_columns):
+        column_indptr.append(column_indptr[-1] + column_lengths[column])
+    column_indices = array("I", [0]) * len(indices)
+    column_data = array("Q", [0]) * len(indices)
+    next_position = column_indptr[:-1]
+    for row in range(len(indptr) - 1):
+        for position in range(indptr[row], indptr[row + 1]):
+            column = indices[position]
+            column_position = next_position[column]
+            column_indices[column_position] = row
+            column_data[column_position] = data[position]
+            next_position[column] = column_position + 1
+
+    return column_indptr, column_indices, column_data
+
+
+def columnar_table_open(table_file):
+    """
+    Map a binary columnar table, or return None for other files.
+    """
+    try:
+        arrays = snapshot_read(table_file)
+    except (OSError, ValueError):  # text tables, pipes
+        return None
+    if arrays.get("format") is None or arrays["format"].tobytes() != FORMAT:
+        return None
+
+    return ColumnarTable(arrays)
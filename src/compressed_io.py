@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   read gzip-, bzip2- or xz-compressed input files transparently, and
+   write block-compressed (BGZF) output files in parallel
+"""
+
+__author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
+__date__ = "2026/10/17"
+__version__ = "$Revision: 1.0"
+
+import io
+import bz2
+import gzip
+import lzma
+import zlib
+import queue
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# compression formats, identified by their magic bytes
+COMPRESSIONS = ((b"\x1f\x8b", gzip),
+                (b"BZh", bz2),
+                (b"\xfd7zXZ\x00", lzma))
+
+# BGZF blocks: gzip members of at most 64 KiB, with their size stored
+# in an extra field (readable by gzip, seekable by htslib tools)
+BGZF_BLOCK_SIZE = 0xff00  # uncompressed bytes per block
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b00"
+                         "03000000000000000000")
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+
+class BackgroundReader(io.RawIOBase):
+    """
+    Read a stream in blocks from a background thread.
+
+    Decompression (zlib, bz2 and lzma release the GIL) then overlaps
+    with the parsing done in the main thread. The source file of the
+    stream, if any, is closed with the stream.
+    """
+
+    def __init__(self, stream, source=None, block_size=1 << 20, depth=8):
+        super().__init__()
+        self.stream = stream
+        self.source = source
+        self.block_size = block_size
+        self.blocks = queue.Queue(depth)
+        self.block = b""
+        self.offset = 0
+        self.eof = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        """
+        Read blocks until the end of the stream (background thread).
+        """
+        try:
+            while not self.stopped:
+                block = self.stream.read(self.block_size)
+                self.blocks.put(block)
+                if not block:
+                    break
+        except Exception as error:  # re-raised in the main thread
+            self.blocks.put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.offset == len(self.block):
+            if self.eof:
+                return 0
+            self.block = self.blocks.get()
+            self.offset = 0
+            if isinstance(self.block, Exception):
+                raise self.block
+            if not self.block:
+                self.eof = True
+                return 0
+        length = min(len(buffer), len(self.block) - self.offset)
+        buffer[:length] = self.block[self.offset:self.offset + length]
+        self.offset += length
+        return length
+
+    def close(self):
+        if not self.closed:
+            # stop the background thread (it may wait for a free slot)
+            self.stopped = True
+            while self.thread.is_alive():
+                try:
+                    self.blocks.get_nowait()
+                except queue.Empty:
+                    self.thread.join(0.01)
+            self.stream.close()
+            if self.source is not None:
+                self.source.close()
+        super().close()
+
+
+class BlockCompressedWriter(io.RawIOBase):
+    """
+    Write a BGZF stream, compressing chunks in parallel.
+
+    Data are cut in chunks of independent blocks, compressed by a pool
+    of threads (zlib releases the GIL) while the main thread keeps
+    producing data. Compressed chunks are written in order.
+    """
+
+    def __init__(self, output, threads=1, level=6, chunk_size=1 << 20):
+        super().__init__()
+        self.output = output
+        self.level = level
+        self.chunk_size = chunk_size
+        self.chunk = bytearray()
+        self.pending = deque()
+        self.max_pending = 2 * threads
+        self.executor = None
+        if threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunk += data
+        if len(self.chunk) >= self.chunk_size:
+            self.submit()
+        return len(data)
+
+    def submit(self):
+        """
+        Compress the current chunk (in the background, if possible).
+        """
+        chunk = bytes(self.chunk)
+        self.chunk = bytearray()
+        if self.executor is None:
+            self.output.write(bgzf_compress(chunk, self.level))
+            return
+        self.pending.append(self.executor.submit(bgzf_compress, chunk,
+                                                 self.level))
+        # bound memory usage: wait for the oldest chunks
+        while len(self.pending) > self.max_pending:
+            self.output.write(self.pending.popleft().result())
+
+    def close(self):
+        if not self.closed:
+            if self.chunk:
+                self.submit()
+            while self.pending:
+                self.output.write(self.pending.popleft().result())
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.output.write(BGZF_EOF)
+            self.output.close()
+        super().close()
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                  Functions                                  #
+#                                                                             #
+# *************************************************************************** #
+
+def compression_of(input_file):
+    """
+    Return the compression module matching the first bytes of a file.
+    """
+    magic = input_file.peek(6)[:6]
+    for signature, compression in COMPRESSIONS:
+        if magic.startswith(signature):
+            return compression
+
+    return None
+
+
+def bgzf_compress(data, level=6):
+    """
+    Compress data into a series of BGZF blocks.
+    """
+    blocks = list()
+    for start in range(0, len(data), BGZF_BLOCK_SIZE):
+        block = data[start:start + BGZF_BLOCK_SIZE]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(block) + compressor.flush()
+        # gzip header with a 'BC' extra field (block size - 1)
+        blocks.append(struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255,
+                                  6, 66, 67, 2, len(compressed) + 25))
+        blocks.append(compressed)
+        blocks.append(struct.pack("<2I", zlib.crc32(block), len(block)))
+
+    return b"".join(blocks)
+
+
+def uncompressed_name(path):
+    """
+    Remove the compression extension of a file name, if any.
+    """
+    for extension in (".gz", ".bz2", ".xz"):
+        if path.endswith(extension):
+            return path[:-len(extension)]
+
+    return path
+
+
+def is_compressed(path):
+    """
+    Check if a file is compressed (regular files only).
+    """
+    with open(path, "rb") as input_file:
+        return compression_of(input_file) is not None
+
+
+def open_input(path, mode="r"):
+    """
+    Open an input file, decompressing it on the fly if need be.
+    """
+    # peek at the first bytes (works with pipes too)
+    input_file = open(path, "rb")
+    compression = compression_of(input_file)
+    if compression is not None:
+        input_file = io.BufferedReader(
+            BackgroundReader(compression.open(input_file, "rb"), input_file),
+            1 << 20)
+    if mode == "rb":
+        return input_file
+
+    return io.TextIOWrapper(input_file)
+
+
+def open_output(path, threads=1):
+    """
+    Open an output file (block-compressed if its name ends with .gz).
+    """
+    if not path.endswith(".gz"):
+        return open(path, "w")
+
+    return io.TextIOWrapper(
+        io.BufferedWriter(BlockCompressedWriter(open(path, "wb"), threads),
+                          1 << 20))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   convert a distribution file into a memory-mapped binary index
+
+   Building the index costs a full parse of the distribution file, and
+   holds all its non-zero counts in memory: it only pays off when
+   several tables are built from the same distribution file (the
+   table builder uses a valid index when there is one).
+"""
+
+__author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
+__date__ = "2026/10/17"
+__version__ = "$Revision: 1.0"
+
+import sys
+import bisect
+import binascii
+from argparse import ArgumentParser
+from array import array
+
+from compressed_io import open_input
+from snapshot_cache import file_fingerprint, snapshot_read, snapshot_write
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+
+class DigestView:
+    """
+    Sequence of fixed-width binary digests (for bisect).
+    """
+
+    def __init__(self, digests, width=20):
+        self.digests = digests
+        self.width = width
+
+    def __len__(self):
+        return len(self.digests) // self.width
+
+    def __getitem__(self, i):
+        return self.digests[self.width * i:self.width * (i + 1)].tobytes()
+
+
+class DistributionIndex:
+    """
+    Read-only view of a binary distribution index.
+
+    Amplicons are sorted by binary digest. The sample ids and counts
+    of the k-th amplicon are stored between offsets[k] and
+    offsets[k + 1]. Sample ids are ranks in the sorted list of sample
+    names. Arrays are memory-mapped, nothing is parsed.
+    """
+
+    def __init__(self, arrays):
+        self.amplicons = DigestView(arrays["amplicons"])
+        self.offsets = arrays["offsets"]
+        self.sample_ids = arrays["sample_ids"]
+        self.counts = arrays["counts"]
+        samples = arrays["samples"].tobytes().decode("utf-8")
+        self.samples = samples.split("\n") if samples else list()
+
+    def __len__(self):
+        return len(self.amplicons)
+
+    def get(self, digest):
+        """
+        Return sample ids and counts of an amplicon (binary digest).
+        """
+        k = bisect.bisect_left(self.amplicons, digest)
+        if k == len(self.amplicons) or self.amplicons[k] != digest:
+            return (), ()
+        start, end = self.offsets[k], self.offsets[k + 1]
+        return self.sample_ids[start:end], self.counts[start:end]
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                  Functions                                  #
+#                                                                             #
+# *************************************************************************** #
+
+def arg_parse():
+    """
+    Parse arguments from command line.
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument("-d", "--distribution",
+                        action="store",
+                        dest="distribution",
+                        required=True)
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        dest="output",
+                        default=None,
+                        required=False,
+                        help="default: distribution file name + '.bin'")
+
+    args = parser.parse_args()
+
+    return args.distribution, args.output
+
+
+def distribution_index_write(distr, index_file=None):
+    """
+    Convert a distribution file into a binary index.
+    """
+    if index_file is None:
+        index_file = distr + ".bin"
+    samples = dict()
+    entries = dict()
+    with open_input(distr, "rb") as distr_file:
+        print("PROGRESS: parsing distribution file", file=sys.stderr)
+        for line in distr_file:
+            amplicon, sample, abundance = line.strip().split(b"\t")
+            # all samples are listed, even without reads
+            sample_id = samples.setdefault(sample, len(samples))
+            abundance = int(abundance)
+            if abundance > 0:
+                digest = binascii.unhexlify(amplicon)
+                entry = entries.get(digest)
+                if entry is None:
+                    entry = entries[digest] = (array("I"), array("Q"))
+                entry[0].append(sample_id)
+                entry[1].append(abundance)
+
+    print("PROGRESS: sorting amplicons and samples", file=sys.stderr)
+    # sample ids become ranks in the sorted list of sample names
+    sorted_samples = sorted(samples)
+    ranks = array("I", [0]) * len(samples)
+    for rank, sample in enumerate(sorted_samples):
+        ranks[samples[sample]] = rank
+    offsets = array("Q", [0])
+    sample_ids = array("I")
+    counts = array("Q")
+    sorted_amplicons = sorted(entries)
+    for digest in sorted_amplicons:
+        # deal with duplicated samples (sum counts)
+        column = dict()
+        for sample_id, count in zip(*entries.pop(digest)):
+            sample_id = ranks[sample_id]
+            column[sample_id] = column.get(sample_id, 0) + count
+        for sample_id in sorted(column):
+            sample_ids.append(sample_id)
+            counts.append(column[sample_id])
+        offsets.append(len(sample_ids))
+
+    snapshot_write(index_file,
+                   {"source": file_fingerprint(distr).encode("ascii"),
+                    "amplicons": b"".join(sorted_amplicons),
+                    "offsets": offsets,
+                    "sample_ids": sample_ids,
+                    "counts": counts,
+                    "samples": b"\n".join(sorted_samples)})
+    print("PROGRESS: indexed", len(sorted_amplicons), "amplicons and",
+          len(sorted_samples), "samples", file=sys.stderr)
+
+    return None
+
+
+def distribution_index_load(distr, index_file=None):
+    """
+    Map the binary index of a distribution file, or return None.
+    """
+    if index_file is None:
+        index_file = distr + ".bin"
+    source = file_fingerprint(distr)
+    if source is None:  # pipes and process substitutions
+        return None
+    try:
+        arrays = snapshot_read(index_file)
+    except (OSError, ValueError):  # no index yet
+        return None
+    # an index built from another version of the file is obsolete
+    if arrays["source"].tobytes().decode("ascii") != source:
+        return None
+
+    return DistributionIndex(arrays)
+
+
+def main():
+    """
+    Convert a distribution file into a binary index.
+    """
+    distr, index_file = arg_parse()
+    distribution_index_write(distr, index_file)
+
+    return
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                     Body                                    #
+#                                                                             #
+# *************************************************************************** #
+
+if __name__ == '__main__':
+
+    main()
+
+    sys.exit(0)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   index fasta files by amplicon name (SHA1), and fetch sequences lazily
+
+   Building an index costs a full parse of the fasta file: it only pays
+   off when the same file is read several times (scripts use a valid
+   index when there is one, and never build it themselves).
+"""
+
+__author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
+__date__ = "2026/10/17"
+__version__ = "$Revision: 1.0"
+
+import os
+import sys
+import mmap
+import bisect
+import binascii
+from argparse import ArgumentParser
+from array import array
+
+from compressed_io import is_compressed
+from distribution_index import DigestView
+from snapshot_cache import file_fingerprint, snapshot_read, snapshot_write
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                   Classes                                   #
+#                                                                             #
+# *************************************************************************** #
+
+class FastaIndex:
+    """
+    Random access to the sequences of a memory-mapped fasta file.
+
+    Amplicons are sorted by binary digest. The sequence of the k-th
+    amplicon starts at offsets[k] and spans lengths[k] bytes (line
+    breaks included, as in samtools faidx). Sequences are only read
+    when requested.
+    """
+
+    def __init__(self, fasta_file, arrays):
+        self.amplicons = DigestView(arrays["amplicons"])
+        self.offsets = arrays["offsets"]
+        self.lengths = arrays["lengths"]
+        self.data = b""
+        if os.path.getsize(fasta_file):  # empty files cannot be mapped
+            with open(fasta_file, "rb") as input_file:
+                self.data = mmap.mmap(input_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.amplicons)
+
+    def digest(self, k):
+        """
+        Return the binary digest of the k-th amplicon.
+        """
+        return self.amplicons[k]
+
+    def sequence(self, k):
+        """
+        Return the sequence of the k-th amplicon.
+        """
+        start = self.offsets[k]
+        sequence = self.data[start:start + self.lengths[k]]
+        return b"".join(sequence.split()).decode("ascii")
+
+    def get(self, digest):
+        """
+        Return the sequence of an amplicon (binary digest), or None.
+        """
+        k = bisect.bisect_left(self.amplicons, digest)
+        if k == len(self.amplicons) or self.amplicons[k] != digest:
+            return None
+        return self.sequence(k)
+
+
+class LazySequences:
+    """
+    Map amplicon ids to sequences located in fasta indexes.
+
+    Only locations are stored, sequences are read on access.
+    """
+
+    def __init__(self):
+        self.locations = dict()
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, amplicon_id):
+        return amplicon_id in self.locations
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __getitem__(self, amplicon_id):
+        index, k = self.locations[amplicon_id]
+        return index.sequence(k)
+
+    def locate(self, amplicon_id, index, k):
+        """
+        Point an amplicon to the k-th sequence of a fasta index.
+        """
+        self.locations[amplicon_id] = (index, k)
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                  Functions                                  #
+#                                                                             #
+# *************************************************************************** #
+
+def arg_parse():
+    """
+    Parse arguments from command line.
+    """
+
+    parser = ArgumentParser()
+
+    parser.add_argument("-f", "--fasta",
+                        action="store",
+                        dest="fasta",
+                        required=True)
+
+    args = parser.parse_args()
+
+    return args.fasta
+
+
+def fasta_index_write(fasta_file):
+    """
+    Locate the sequence of each amplicon in a fasta file, write an index.
+    """
+    separator = b";size="
+    locations = dict()
+    offset = 0
+    digest = None
+    with open(fasta_file, "rb") as input_file:
+        print("PROGRESS: indexing fasta file", fasta_file, file=sys.stderr)
+        for line in input_file:
+            if line.startswith(b">"):
+                if digest is not None:
+                    locations[digest] = (start, offset - start)
+                amplicon = line.strip(b">;\r\n").split(separator)[0]
+                digest = binascii.unhexlify(amplicon)
+                start = offset + len(line)
+            offset += len(line)
+    if digest is not None:
+        locations[digest] = (start, offset - start)
+
+    # duplicated amplicons: the last occurrence wins
+    sorted_amplicons = sorted(locations)
+    index_file = fasta_file + ".idx"
+    snapshot_write(index_file + ".tmp",
+                   {"source": file_fingerprint(fasta_file).encode("ascii"),
+                    "amplicons": b"".join(sorted_amplicons),
+                    "offsets": array("Q", [locations[digest][0]
+                                           for digest in sorted_amplicons]),
+                    "lengths": array("Q", [locations[digest][1]
+                                           for digest in sorted_amplicons])})
+    os.replace(index_file + ".tmp", index_file)
+    print("PROGRESS: indexed", len(sorted_amplicons), "amplicons",
+          file=sys.stderr)
+
+    return None
+
+
+def fasta_index_load(fasta_file):
+    """
+    Map the index of a fasta file, or return None.
+    """
+    # pipes and compressed files cannot be mapped
+    source = file_fingerprint(fasta_file)
+    if source is None or is_compressed(fasta_file):
+        return None
+    try:
+        arrays = snapshot_read(fasta_file + ".idx")
+    except (OSError, ValueError):  # no index
+        return None
+    # an index built from another version of the file is obsolete
+    if arrays["source"].tobytes().decode("ascii") != source:
+        return None
+
+    return FastaIndex(fasta_file, arrays)
+
+
+def main():
+    """
+    Index a fasta file.
+    """
+    fasta_index_write(arg_parse())
+
+    return
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                     Body                                    #
+#                                                                             #
+# *************************************************************************** #
+
+if __name__ == '__main__':
+
+    main()
+
+    sys.exit(0)
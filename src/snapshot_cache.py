@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   persistent cache of parsed inputs (memory-mapped binary snapshots)
+"""
+
+__author__ = "Frédéric Mahé <frederic.mahe@cirad.fr>"
+__date__ = "2026/10/17"
+__version__ = "$Revision: 1.0"
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+
+
+MAGIC = b"SNAPSHOT1\n"
+SAMPLE_SIZE = 1 << 20  # bytes hashed at the start, middle and end of files
+
+
+# *************************************************************************** #
+#                                                                             #
+#                                  Functions                                  #
+#                                                                             #
+# *************************************************************************** #
+
+def file_fingerprint(path):
+    """
+    Identify a file by its size, modification time and content.
+    """
+    # pipes and process substitutions cannot be cached
+    if not os.path.isfile(path):
+        return None
+    status = os.stat(path)
+    # hash the start, the middle and the end of the file (hashing
+    # multi-GB files entirely would cost as much as parsing them)
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as input_file:
+        for offset in (0,
+                       max(0, status.st_size // 2 - SAMPLE_SIZE // 2),
+                       max(0, status.st_size - SAMPLE_SIZE)):
+            input_file.seek(offset)
+            sha1.update(input_file.read(SAMPLE_SIZE))
+
+    return ":".join((str(status.st_size), str(status.st_mtime_ns),
+                     sha1.hexdigest()))
+
+
+def digests_fingerprint(digests):
+    """
+    Identify a set of binary amplicon digests (order-independent).
+    """
+    return hashlib.sha1(b"".join(sorted(digests))).hexdigest()
+
+
+def cache_key(*parts):
+    """
+    Build a cache key from parser version and input fingerprints.
+    """
+    if None in parts:  # at least one input cannot be cached
+        return None
+
+    return hashlib.sha1("\0".join(map(str, parts)).encode()).hexdigest()
+
+
+def snapshot_write(snapshot_file, arrays):
+    """
+    Write named arrays (array.array or bytes) to a binary snapshot.
+    """
+    # layout: magic, header length, json header, then 8-byte aligned
+    # raw arrays (header lists typecode, offset and length of arrays)
+    header = dict()
+    offset = 0
+    for name, values in arrays.items():
+        typecode = getattr(values, "typecode", "B")
+        size = len(values) * getattr(values, "itemsize", 1)
+        header[name] = (typecode, offset, size)
+        offset += size + (-size % 8)
+    header = json.dumps(header).encode()
+    start = len(MAGIC) + 8 + len(header)
+    start += -start % 8
+    with open(snapshot_file, "wb") as output_file:
+        output_file.write(MAGIC)
+        output_file.write(struct.pack("<Q", len(header)))
+        output_file.write(header)
+        output_file.write(bytes(start - output_file.tell()))
+        for values in arrays.values():
+            data = values if isinstance(values, bytes) else values.tobytes()
+            output_file.write(data)
+            output_file.write(bytes(-len(data) % 8))
+
+    return None
+
+
+def snapshot_read(snapshot_file):
+    """
+    Map a binary snapshot in memory (arrays are zero-copy views).
+    """
+    with open(snapshot_file, "rb") as input_file:
+        data = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[0:len(MAGIC)] != MAGIC:
+        raise ValueError("not a snapshot file: " + snapshot_file)
+    position = len(MAGIC)
+    header_size = struct.unpack("<Q", data[position:position + 8])[0]
+    position += 8
+    header = json.loads(data[position:position + header_size].decode())
+    start = position + header_size
+    start += -start % 8
+    view = memoryview(data)
+    arrays = dict()
+    for name, (typecode, offset, size) in header.items():
+        arrays[name] = view[start + offset:start + offset + size].cast(
+            typecode)
+
+    return arrays
+
+
+def cache_load(cache_dir, key):
+    """
+    Return the arrays of a cached snapshot, or None.
+    """
+    if cache_dir is None or key is None:
+        return None
+    snapshot_file = os.path.join(cache_dir, key + ".snapshot")
+    try:
+        arrays = snapshot_read(snapshot_file)
+        os.utime(snapshot_file)  # most recently used
+    except (OSError, ValueError):
+        return None
+
+    return arrays
+
+
+def cache_store(cache_dir, key, arrays, max_size):
+    """
+    Store arrays as a snapshot, and evict least recently used ones.
+    """
+    if cache_dir is None or key is None:
+        return None
+    snapshot_file = os.path.join(cache_dir, key + ".snapshot")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first (concurrent runs)
+        snapshot_write(snapshot_file + ".tmp", arrays)
+        os.replace(snapshot_file + ".tmp", snapshot_file)
+        cache_evict(cache_dir, max_size)
+    except OSError:
+        print("WARNING: cannot write to cache", cache_dir, file=sys.stderr)
+
+    return None
+
+
+def cache_evict(cache_dir, max_size):
+    """
+    Remove least recently used snapshots until the cache fits max_size.
+    """
+    snapshots = list()
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".snapshot"):
+            status = entry.stat()
+            snapshots.append((status.st_mtime, status.st_size, entry.path))
+    total_size = sum([size for mtime, size, path in snapshots])
+    # oldest first (the most recent snapshot is always kept)
+    snapshots.sort()
+    for mtime, size, path in snapshots[:-1]:
+        if total_size <= max_size:
+            break
+        os.remove(path)
+        total_size -= size
+
+    return None